@@ -25,8 +25,8 @@ def generalize(osm_object, tolerance):
     @param tolerance: The tolerance value for the generlization in meters
     """
 
-    # add the tolerance value to the set of already performed generalizations 
-    osm_object.generalized.add(tolerance)
+    # add the tolerance value to the list of already performed generalizations 
+    osm_object.add_generalized(tolerance)
     
     # get all streets of the OSM data representation
     ways = [osm_object.getWayByID(index) for index in osm_object.street_tree.intersection(osm_object.box, "raw")]
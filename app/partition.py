@@ -115,7 +115,7 @@ class PartitionFinder(object):
     def connect_partitions(self, partition_thresholds):
         """ Initializes the connection of all partitions with each other
         
-        @param partition_thresholds: a dictionary containing search distance, projection threshold, size threshold, connection threshold and distance threshold { 'search':svalue, 'projection':pvalue, 'size':sivalue, 'connection':cvalue, 'distance':dvalue }
+        @param partition_thresholds: a dictionary containing search distance, projection threshold, size threshold, connection threshold and distance threshold as C{int} { 'search':svalue, 'projection':pvalue, 'size':sivalue, 'connection':cvalue, 'distance':dvalue }
         """
         
         # do a recalculation of the partitions if neccessary
@@ -329,15 +329,15 @@ class PartitionFinder(object):
         
         @type partition_id: C{int}
         @param partition_id: partition id
-        @param thresholds: a dictionary containing search distance, projection threshold, size threshold, connection threshold and distance threshold { 'search':svalue, 'projection':pvalue, 'size':sivalue, 'connection':cvalue, 'distance':dvalue }
+        @param thresholds: a dictionary containing search distance, projection threshold, size threshold, connection threshold and distance threshold as C{int} { 'search':svalue, 'projection':pvalue, 'size':sivalue, 'connection':cvalue, 'distance':dvalue }
         @returns: True if the partition was successfully connected with the street network
         @rtype: C{bool}
         """
-        search_threshold = int(thresholds.get('search'))
-        projection_threshold = int(thresholds.get('projection'))
-        size_threshold = int(thresholds.get('size'))
-        connection_threshold = int(thresholds.get('connection'))
-        distance_threshold = int(thresholds.get('distance'))
+        search_threshold = thresholds.get('search')
+        projection_threshold = thresholds.get('projection')
+        size_threshold = thresholds.get('size')
+        connection_threshold = thresholds.get('connection')
+        distance_threshold = thresholds.get('distance')
         
         partition = self.__partitions.get(partition_id)
         
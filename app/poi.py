@@ -44,7 +44,7 @@ class Poi(object):
         
         Selected nodes that aren't already part of the street network are marked as POI_selected
         
-        @param items: dictionary of key/value pairs that are used to select a poi
+        @param items: iterable of (key, value) pairs that are used to select a poi
         @returns: a set of the selected L{geo.osm_import.Node} objects
         @rtype: C{set} of L{geo.osm_import.Node}
         """
@@ -271,11 +271,11 @@ class Poi(object):
     def connect_poi(self, poi_thresholds):
         """ Initializes the connection of the points of interests with the street network
         
-        @param poi_thresholds: a dictionary containing search distance, projection threshold and address threshold { 'search':svalue, 'projection':pvalue, 'address':avalue }
+        @param poi_thresholds: a dictionary containing search distance, projection threshold and address threshold as C{int} { 'search':svalue, 'projection':pvalue, 'address':avalue }
         """
-        search_threshold = int(poi_thresholds.get('search'))
-        projection_threshold = int(poi_thresholds.get('projection'))
-        address_threshold = int(poi_thresholds.get('address'))
+        search_threshold = poi_thresholds.get('search')
+        projection_threshold = poi_thresholds.get('projection')
+        address_threshold = poi_thresholds.get('address')
         for poi_node in self.__poi_nodes:
             
 
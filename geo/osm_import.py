@@ -5,6 +5,7 @@ It is responsible for the import and storage of the different OSM objects.
 
 from app.partition import PartitionFinder
 from bintrees.avltree import AVLTree
+from bisect import bisect_left
 #from data_structures.pr_quadtree import PRQuadtree
 from geo.geo_utils import is_area, create_node_box
 from imposm_mod.parser import OSMParser
@@ -517,8 +518,7 @@ class OSM_objects(object):
         
         # raw data received from the callback functions
         self.__imported_bounds = [] #: stores the bounding box as given in the OSM file as a list [min_lon, min_lat, max_lon, max_lat]
-        self.__nodes = []
-        self.__ways = []
+        self.__ways = [] #: raw way parameters, buffered until all nodes have been received
         self.__relations = {}
         
 
@@ -541,7 +541,7 @@ class OSM_objects(object):
         self.__way_avl = AVLTree() #: instance of AVL-tree-object that stores L{Way} objects
         
         self.__poi = set() #: stores a set of L{Node} objects that are selected as POI
-        self.__generalized = set() #: stores the tolerance values of previously performed generalizations as a set 
+        self.__generalized = [] #: stores the tolerance values of previously performed generalizations as a sorted list 
         self.__partitions = None #: stores an instance of an L{app.partition.PartitionFinder} object
         
 
@@ -602,6 +602,18 @@ class OSM_objects(object):
         """
         return self.__way_avl.get(index)
     
+    def getWaysByIDs(self, indices):
+        """ Gets for given OSM ids the corresponding L{Way} objects
+        
+        Looks up the ways without a method call per id, e.g. for the results of an R-tree intersection.
+        
+        @param indices: iterable of OSM ids
+        @returns: list of the corresponding L{Way} objects, C{None} for ids without such object
+        @rtype: C{list}
+        """
+        get = self.__way_avl.get
+        return [get(index) for index in indices]
+    
     def getWayDelete(self):
         """ Gets the OSM ways that are marked as 'deleted' in the original OSM file
         
@@ -645,19 +657,28 @@ class OSM_objects(object):
         return self.__poi
 
     def get_generalized(self):
-        """ Returns the tolerance values of previously performed generalizations as a set
+        """ Returns the tolerance values of previously performed generalizations as a sorted list
         
-        @returns: the tolerance values of previously performed generalizations as a set
-        @rtype: C{set} of C{int}
+        @returns: the tolerance values of previously performed generalizations in ascending order
+        @rtype: C{list} of C{int}
         """
         return self.__generalized
-    generalized = property(get_generalized, None, None, 'read-only property for the tolerance values of previously performed generalizations')
+    generalized = property(get_generalized, None, None, 'read-only property for the sorted tolerance values of previously performed generalizations')
+    
+    def add_generalized(self, tolerance):
+        """ Adds a tolerance value to the previously performed generalizations, keeping them sorted
+        
+        @param tolerance: tolerance value of the generalization
+        """
+        position = bisect_left(self.__generalized, tolerance)
+        if position == len(self.__generalized) or self.__generalized[position] != tolerance:
+            self.__generalized.insert(position, tolerance)
     
     def reset_generalized(self):
         """
-        Clears the set of previously performed generalizations
+        Clears the list of previously performed generalizations
         """
-        self.__generalized = set()
+        self.__generalized = []
         
     def get_utm_projection(self):
         """ Returns an instance of a pyproj.Proj object which uses the UTM projection
@@ -737,13 +758,20 @@ class OSM_objects(object):
         	- tags: {tag_key1:tag_value1, tag_key2:tag_value2, ...}
         	- attr: {attr_name1:attr_val1, attr_name2:attr_val2, ...}
         
+        The L{Node} objects are created directly from the received parameters,
+        the raw parameters are not stored.
         The method also determines the min/max coordinates of the calculated bounding box. 
         
         @param nodes: list of node parameters
         """
-        for node in nodes:
-            self.__nodes.append(node)
-            osm_id, tags, (lon, lat), attr = node
+        node_avl = self.__node_avl
+        for osm_id, tags, (lon, lat), attr in nodes:
+            nd = Node(osm_id=osm_id, lon=lon, lat=lat, tags=tags, attr=attr, osm_object=self)
+            
+            # insert the created node object into the avl tree
+            # osm_id as tree node key and the node object as tree node item
+            # used for look up of a node object by its osm_id
+            node_avl.insert(osm_id, nd)
             
             # find the min/max coordinates to calculate the bounding box
             if lon < self.__min_lon: self.__min_lon = lon
@@ -760,6 +788,10 @@ class OSM_objects(object):
         	- refs: [ref_id1, ref_id2, ...]
         	- attr: {attr_name1:attr_val1, attr_name2:attr_val2, ...}
         
+        The L{Way} objects cannot be created here: the parser processes deliver
+        their results concurrently, so the referenced nodes may not have been
+        received yet. The way parameters are buffered until L{parse} has finished.
+        
         @param ways: list of way parameters
         """
         self.__ways.extend(ways)
@@ -781,20 +813,13 @@ class OSM_objects(object):
 
 
 
-    def __create_nodes(self):
-        """ Creates the L{Node} objects from the imported node parameters        
-        """
-        for osm_id, tags, coord, attr in self.__nodes:
-            nd = Node(osm_id=osm_id, lon=coord[0], lat=coord[1], tags=tags, attr=attr, osm_object=self)
-        
-            # insert the created node object into the avl tree
-            # osm_id as tree node key and the node object as tree node item
-            # used for look up of a node object by its osm_id
-            self.__node_avl.insert(osm_id, nd)
-
     def __create_ways(self):
         """ Creates the L{Way} objects from the imported way parameters
+        
+        The streets are bulk loaded into the R-tree by the stream constructor of rtree,
+        which sorts them into the tree nodes itself.
         """
+        streets = []
         for osm_id, tags, nodes, attr in self.__ways:
             way = Way(osm_id, nodes, tags, attr, self.__node_avl)
             
@@ -809,7 +834,7 @@ class OSM_objects(object):
                     # if we insert a way object a copy of the object would be inserted
                     # but we need references!
                     # --> the AVL tree __way_avl is used to look up the way object by its osm_id
-                    self.__street_tree.insert(osm_id, way.box, osm_id)
+                    streets.append((osm_id, way.box, osm_id))
             
                 # insert the buildings into th R-tree
                 elif tags.get('building') == 'yes':
@@ -827,6 +852,12 @@ class OSM_objects(object):
             # osm_id as tree node key and the way object as tree node item
             # used for look up of a way object by its osm_id
             self.__way_avl.insert(osm_id, way)
+        
+        # the raw way parameters are not needed anymore
+        self.__ways = []
+        
+        if streets:
+            self.__street_tree = index.Index(iter(streets), properties=index.Property())
 
     def __create_bounds(self):
         """ Creates the calculated bounding box and the C{pyproj.Proj} objects for UTM- and epsg:3857-projection
@@ -963,21 +994,13 @@ class OSM_objects(object):
     def parse(self):
         """ Initializes the parsing of the OSM file.
         
-        Starts the methods to parse the OSM file, to calculate the bounding box and to create the L{geo.osm_import.Node} and L{geo.osm_import.Way} objects
+        Starts the methods to parse the OSM file, to calculate the bounding box and to create the L{geo.osm_import.Way} objects.
+        The L{geo.osm_import.Node} objects are already created while parsing.
         """
-        # TODO: remove profiling message
-        
         self.__parser_object.parse(self.__infile)
         
         self.__create_bounds()
         
-        #starttime = datetime.datetime.today()
-        #print 'start: %s' % starttime
-        self.__create_nodes()
-        #finishedtime = datetime.datetime.today()
-        #print 'finished: %s' % finishedtime
-        #print finishedtime - starttime
-        
         self.__create_ways()
         
     
@@ -1,8 +1,13 @@
 """ The module C{geo.osm_map_rendering} provides methods to display the map in the window of the MoSP GeoTool
 @author: C. Protsch
 """
-from geo.tile_image import background_from_tiles, pil_image_to_pixbuf
+from array import array
+from geo.tile_image import TILE_SIZE, background_from_tiles, pil_image_to_pixbuf, set_tile_cache_size
 from geo.zoom import ZoomObject
+from itertools import islice, izip
+from operator import attrgetter
+import cairo
+import gobject
 import gtk
 from app.poi import POI_SELECTED, POI_CONNECTED, POI_NOT_CONNECTED
 
@@ -14,6 +19,10 @@ __license__ = "GPLv3"
 
 POI_SIZE = 8
 FOREGROUND_COLOR = '#666'
+WAY_COLORS = ['#f00','#0f0', '#00f'] #: colors of the partitions that are not the largest one
+STREET_LAYERS = 4 #: maximum number of cached street layers, one per combination of display settings
+MOVE_STEPS = {'Left': (1, 0), 'Right': (-1, 0), 'Up': (0, -1), 'Down': (0, 1)} #: movement of the map by key name in half map widths and heights, see L{OSMMapRendering.move_by}
+TILE_CACHE_SCREENS = 5 #: number of screens of tiles kept in memory, enough for the displayed tiles, the prefetched ones around them and the tiles of the previous zoom levels that replace missing tiles
 
 class OSMMapRendering(object):
     """ Objects of the class C{OSMMapRendering} stores the display parameters of the map.
@@ -38,18 +47,32 @@ class OSMMapRendering(object):
         self.__show_partitions = False  #: stores if the partitions are shown
         
         self.__osm_object = osm_object  #: OSM data representation
+        
+        # the colors don't change, create the gtk.gdk.Color objects only once
+        self.__fg_color = gtk.gdk.Color(FOREGROUND_COLOR)   #: color of the streets
+        self.__red_color = gtk.gdk.Color('#f00')            #: color of the filtered streets
+        self.__part_colors = [gtk.gdk.Color(c) for c in WAY_COLORS] #: colors of the partitions
+        
+        # size the tile cache to the window, a screen may be covered by one additional tile in each direction
+        set_tile_cache_size(((width + TILE_SIZE - 1) // TILE_SIZE + 1) * ((height + TILE_SIZE - 1) // TILE_SIZE + 1) * TILE_CACHE_SCREENS)
+        
         self.__osm_box = osm_object.street_tree.get_bounds() #: bounding box of all street objects
         self.__zoom_object = ZoomObject(size) #: stores a reference to the L{geo.zoom.ZoomObject} 
         self.__zoom_object.find_zoom_level(self.__osm_box)
         
         self.__viewport_coordinates = self.__zoom_object.viewport_coordinates() #: Geographic coordinates of the edges of the visible area
-                
+        
+        # the drawing area and the viewport are created once and reused when the map is moved or zoomed
+        self.__area = None
         self.__draw_map()
 
         self.__show_generalized = 0     #: stores the tolerance value of the generalization currently shown
 
     def __draw_map(self):
         """ The method initialized the drawing of the map
+        
+        On the first call the drawing area and the viewport are created,
+        later calls only update their dimensions.
         """
         
         # calculate the pixel dimensions
@@ -61,9 +84,29 @@ class OSMMapRendering(object):
         self.__width = self.__max_x - self.__min_x
         self.__height = self.__max_y - self.__min_y
         self.__pixel_width, self.__pixel_height = self.__zoom_object.tile_box_pixel()
+        
+        # the transformation from geodetic to pixel coordinates is affine,
+        # precompute the scale factors
+        self.__scale_x = float(self.__pixel_width) / self.__width     #: pixels per meter in x direction
+        self.__scale_y = float(self.__pixel_height) / self.__height   #: pixels per meter in y direction
 
         # calculate the adjustment of the map
         position = self.__zoom_object.get_position_in_tile(self.__osm_box[3], self.__osm_box[0])
+        
+        self.__viewport_coordinates = self.__zoom_object.viewport_coordinates()
+        self.__street_box = self.increase_box(self.__viewport_coordinates)
+        
+        # the map dimensions have changed, all layers have to be rendered again
+        self.__tiles_pixbuf = None      #: cached pixbuf of the background tiles
+        self.__street_surfaces = {}     #: cached cairo surfaces with the rendered streets by the display settings they were rendered with
+        
+        if self.__area is not None:
+            # the widgets already exist, only their dimensions change
+            self.__vadj.set_all(position[1], 0, self.__pixel_height, 10, 100, self.__window_height)
+            self.__hadj.set_all(position[0], 0, self.__pixel_width, 10, 100, self.__window_width)
+            self.__area.set_size_request(self.__pixel_width, self.__pixel_height)
+            return
+        
         self.__vadj = gtk.Adjustment(position[1], lower=0,
                                      upper=self.__pixel_height,
                                      step_incr=10,
@@ -80,9 +123,6 @@ class OSMMapRendering(object):
         self.__area = gtk.DrawingArea() #: U{GTK drawing area<http://developer.gnome.org/pygtk/stable/class-gtkdrawingarea.html>}
         self.__area.set_size_request(self.__pixel_width, self.__pixel_height)
         
-        self.__viewport_coordinates = self.__zoom_object.viewport_coordinates()
-        self.__street_box = self.increase_box(self.__viewport_coordinates)
-        
         # start the drawing itself
         self.__area.connect("expose-event", self.__draw_ways)
         
@@ -174,54 +214,43 @@ class OSMMapRendering(object):
 
 
 
-        # create the background image if tiles are activated 
+        # only the exposed part of the layers has to be drawn
+        x, y, width, height = event.area
+
+        # draw the background image if tiles are activated,
+        # the image is created only once after the map has been moved/zoomed
+        # and once more when missing tiles have been downloaded
         if self.__show_tiles:
-            background_image = background_from_tiles(self.__zoom_object.get_tiles(), self.__zoom_object.zoom_level)
-            pixbuf = pil_image_to_pixbuf(background_image)
-            self.__area.window.draw_pixbuf(self.gc, pixbuf, 0, 0, 0, 0)
+            if self.__tiles_pixbuf is None:
+                background_image = background_from_tiles(self.__zoom_object.get_tiles(), self.__zoom_object.zoom_level, self.__tiles_loaded)
+                self.__tiles_pixbuf = pil_image_to_pixbuf(background_image)
+            # the area can be larger than the image, draw_pixbuf fails for a rectangle outside of it
+            tiles_width = min(width, self.__tiles_pixbuf.get_width() - x)
+            tiles_height = min(height, self.__tiles_pixbuf.get_height() - y)
+            if tiles_width > 0 and tiles_height > 0:
+                self.__area.window.draw_pixbuf(self.gc, self.__tiles_pixbuf, x, y, x, y, tiles_width, tiles_height)
 
-        #ways = [self.__osm_object.getWayByID(index) for index in self.__osm_object.way_tree.intersection(self.__osm_object.box, "raw")]
-        #way_colors = ['#f00','#0f0', '#00f', '#f0f', '#0ff', '#f0f']
-        way_colors = ['#f00','#0f0', '#00f']
+        # recalculate the partitions if the streets have been changed
+        if self.__show_partitions:
+            partitions = self.__osm_object.get_partitions()
+            if partitions.recalculate:
+                self.__osm_object.recalculate_partitions()
+                self.__street_surfaces.clear()
         
         # draw the streets
-        ways = [self.__osm_object.getWayByID(index) for index in self.__osm_object.street_tree.intersection(self.__street_box, "raw")]
-        for way in ways:
-            
-            # calculate color and thickness of the streets,
-            # depending on what is displayed
-            self.gc.line_width = 1
-            if self.__show_tiles:
-                self.gc.line_width += 1
-            if self.__show_partitions:
-                self.__osm_object.get_partitions()
-                if self.__osm_object.get_partitions().recalculate:
-                    self.__osm_object.recalculate_partitions()
-                partition = way.partition_id
-                if self.__osm_object.get_partitions().get_largest_partition() == partition:
-                    self.gc.set_rgb_fg_color(gtk.gdk.Color(FOREGROUND_COLOR))
-                elif partition == -1:
-                    self.gc.line_width += 3
-                    self.gc.set_rgb_fg_color(gtk.gdk.Color('#f00'))
-                else:
-                    self.gc.line_width += 2
-                    self.gc.set_rgb_fg_color(gtk.gdk.Color(way_colors[partition % len(way_colors)]))
-            
-            # find the nodes for drawing the lines
-            if 'highway' in way.getTags():
-                points = []
-                if self.__show_generalized == 0:
-                    nodes = way.nodes
-                else:
-                    # if necessary use the generalized way
-                    nodes = way.generalized.get(self.__show_generalized)
-                for node in nodes:
-                    node_x, node_y = node.get_xy()
-                    points.append((self.__pixel_x(node_x), self.__pixel_y(node_y)))
-                self.__area.window.draw_lines(self.gc, points)
-        
-        if self.__show_partitions:
-            self.gc.set_rgb_fg_color(gtk.gdk.Color(FOREGROUND_COLOR))
+        # the streets are rendered only if the map has been moved/zoomed,
+        # the data has been changed or the display settings are used for the first time
+        street_state = (self.__show_tiles, self.__show_partitions, self.__show_generalized)
+        street_surface = self.__street_surfaces.get(street_state)
+        if street_surface is None:
+            if len(self.__street_surfaces) >= STREET_LAYERS:
+                self.__street_surfaces.clear()
+            street_surface = self.__street_surfaces[street_state] = self.__render_streets()
+        ctx = self.__area.window.cairo_create()
+        ctx.rectangle(x, y, width, height)
+        ctx.clip()
+        ctx.set_source_surface(street_surface, 0, 0)
+        ctx.paint()
         
         # draw the POI
         if self.__show_poi:
@@ -240,7 +269,108 @@ class OSMMapRendering(object):
                                             self.__pixel_x(node_x)-POI_SIZE/2,
                                             self.__pixel_y(node_y)-POI_SIZE/2,
                                             POI_SIZE, POI_SIZE, 0, 360*64)
-            self.gc.set_rgb_fg_color(gtk.gdk.Color(FOREGROUND_COLOR))
+            self.gc.set_rgb_fg_color(self.__fg_color)
+        
+    def __tiles_loaded(self):
+        """ Called by the download thread of L{geo.tile_image.background_from_tiles} when missing tiles are available """
+        gobject.idle_add(self.__redraw_tiles)
+
+    def __redraw_tiles(self):
+        """ Creates the background image again with the downloaded tiles, runs in the GTK main loop
+        
+        @returns: C{False}, so the idle callback is removed
+        @rtype: C{bool}
+        """
+        self.__tiles_pixbuf = None
+        self.__area.queue_draw()
+        return False
+
+    def __render_streets(self):
+        """ Renders the streets into an off-screen cairo surface
+        
+        The streets are grouped by color and line width,
+        each group is drawn as one path with a single stroke.
+        
+        @returns: the surface with the rendered streets
+        @rtype: C{cairo.ImageSurface}
+        """
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.__pixel_width, self.__pixel_height)
+        ctx = cairo.Context(surface)
+        
+        # 0: foreground, 1: filtered streets, >= 2: other partitions
+        palette = [self.__fg_color, self.__red_color] + self.__part_colors
+        n_part_colors = len(self.__part_colors)
+        
+        line_width = 1
+        if self.__show_tiles:
+            line_width += 1
+        if self.__show_partitions:
+            largest_partition = self.__osm_object.get_partitions().get_largest_partition()
+        
+        # the intersection result is only iterated once, so don't build a list
+        get_way = self.__osm_object.getWayByID
+        intersection = self.__osm_object.street_tree.intersection
+        ways = (get_way(index) for index in intersection(self.__street_box, "raw"))
+        
+        projection = self.__projection
+        min_x, max_y = self.__min_x, self.__max_y
+        scale_x, scale_y = self.__scale_x, self.__scale_y
+        
+        # the shown generalization doesn't change while rendering
+        tolerance = self.__show_generalized
+        if tolerance == 0:
+            get_nodes = attrgetter('nodes')
+        else:
+            # if necessary use the generalized way
+            get_nodes = lambda way: way.generalized.get(tolerance)
+        
+        groups = {} # (color index, line width) as key and a list of (x pixels, y pixels) arrays as value
+        for way in ways:
+            
+            # calculate color and thickness of the streets,
+            # depending on what is displayed
+            style = (0, line_width)
+            if self.__show_partitions:
+                partition = way.partition_id
+                if largest_partition == partition:
+                    pass
+                elif partition == -1:
+                    style = (1, line_width + 3)
+                else:
+                    style = (2 + partition % n_part_colors, line_width + 2)
+            
+            # find the nodes for drawing the lines
+            if 'highway' in way.getTags():
+                nodes = get_nodes(way)
+                if not nodes:
+                    continue
+                # project all nodes of the way with a single call
+                # and calculate the pixel coordinates (see __pixel_x, __pixel_y)
+                # store them as typed arrays instead of a list of point tuples
+                xs, ys = projection([node.lon for node in nodes], [node.lat for node in nodes])
+                pixels_x = array('i', [int((x - min_x) * scale_x) + 1 for x in xs])
+                pixels_y = array('i', [int((max_y - y) * scale_y) + 1 for y in ys])
+                if pixels_x:
+                    groups.setdefault(style, []).append((pixels_x, pixels_y))
+        
+        for (color_index, width), lines in groups.iteritems():
+            color = palette[color_index]
+            ctx.set_source_rgb(color.red_float, color.green_float, color.blue_float)
+            ctx.set_line_width(width)
+            for pixels_x, pixels_y in lines:
+                ctx.move_to(pixels_x[0], pixels_y[0])
+                for x, y in islice(izip(pixels_x, pixels_y), 1, None):
+                    ctx.line_to(x, y)
+            ctx.stroke()
+        return surface
+    
+    def invalidate(self):
+        """ Discards the rendered streets, they are rendered again on the next redraw
+        
+        Has to be called if the streets of the OSM data representation have been changed.
+        The background tiles are kept.
+        """
+        self.__street_surfaces.clear()
         
     def __pixel_x(self, x):
         """ Calculates for a given geodetic x coordinate the pixel coordinate based on the dimensions of the map
@@ -250,7 +380,7 @@ class OSMMapRendering(object):
         @returns: pixel coordinate in x direction
         @rtype: C{int}
         """
-        return int((x - self.__min_x) * self.__pixel_width / self.__width) + 1
+        return int((x - self.__min_x) * self.__scale_x) + 1
 
     def __pixel_y(self, y):
         """ Calculates for a given geodetic y coordinate the pixel coordinate based on the dimensions of the map
@@ -260,7 +390,7 @@ class OSMMapRendering(object):
         @returns: pixel coordinate in y direction
         @rtype: C{int}
         """
-        return int((self.__max_y - y) * self.__pixel_height / self.__height) + 1
+        return int((self.__max_y - y) * self.__scale_y) + 1
 
     def zoom_in(self):
         """ Increases the OSM zoom level by 1 and initializes the recalculation of the map dimensions     
@@ -287,28 +417,22 @@ class OSMMapRendering(object):
         
         @param keyname: one of 'Left', 'Right', 'Up' or 'Down'
         """
-        d_x = self.__osm_box[2] - self.__osm_box[0]
-        d_y = self.__osm_box[3] - self.__osm_box[1]
-        if keyname == 'Left':
-            self.__osm_box[0] += d_x/2
-            self.__osm_box[2] += d_x/2
-            #self.__street_box[0] += d_x/2
-            #self.__street_box[2] += d_x/2
-        if keyname == 'Right':
-            self.__osm_box[0] -= d_x/2
-            self.__osm_box[2] -= d_x/2
-            #self.__street_box[0] -= d_x/2
-            #self.__street_box[2] -= d_x/2
-        if keyname == 'Up':
-            self.__osm_box[1] -= d_y/2
-            self.__osm_box[3] -= d_y/2
-            #self.__street_box[1] -= d_y/2
-            #self.__street_box[3] -= d_y/2
-        if keyname == 'Down':
-            self.__osm_box[1] += d_y/2
-            self.__osm_box[3] += d_y/2
-            #self.__street_box[1] += d_y/2
-            #self.__street_box[3] += d_y/2
+        self.move_by(*MOVE_STEPS[keyname])
+        
+    def move_by(self, steps_x, steps_y):
+        """ Moves the map by multiples of half its size and initializes the recalculation of the map dimensions once
+        
+        @type steps_x: C{int}
+        @param steps_x: movement in half map widths, positive values move the map to the left
+        @type steps_y: C{int}
+        @param steps_y: movement in half map heights, positive values move the map down
+        """
+        d_x = (self.__osm_box[2] - self.__osm_box[0]) / 2 * steps_x
+        d_y = (self.__osm_box[3] - self.__osm_box[1]) / 2 * steps_y
+        self.__osm_box[0] += d_x
+        self.__osm_box[2] += d_x
+        self.__osm_box[1] += d_y
+        self.__osm_box[3] += d_y
         self.__zoom_object.find_zoom_level(self.__osm_box)
         self.__draw_map()
         
@@ -344,6 +468,14 @@ class OSMMapRendering(object):
                          box[3] - d_y/4]
         return decreased_box   
 
+    def get_show_tiles(self):
+        """ Returns the state if the OSM tiles are shown
+        
+        @returns: True if the tiles are shown
+        @rtype: C{bool}
+        """
+        return self.__show_tiles
+
     def set_show_tiles(self, state):
         """ Sets the state if the OSM tiles are shown
         
@@ -351,7 +483,7 @@ class OSMMapRendering(object):
         @param state: True if the tiles are shown
         """
         self.__show_tiles = state
-    show_tiles = property(None, set_show_tiles, None, 'write-only property for the "show tile" state')
+    show_tiles = property(get_show_tiles, set_show_tiles, None, 'read/write-property for the "show tile" state')
 
     def set_show_poi(self, state):
         """ Sets the state if the points of interest are shown
@@ -362,6 +494,14 @@ class OSMMapRendering(object):
         self.__show_poi = state
     show_poi = property(None, set_show_poi, None, 'write-only property for the "show POI" state')        
 
+    def get_show_partitions(self):
+        """ Returns the state if the partitions are shown
+        
+        @returns: True if the partitions are shown
+        @rtype: C{bool}
+        """
+        return self.__show_partitions
+
     def set_show_partitions(self, state):
         """ Sets the state if the partitions are shown
         
@@ -369,7 +509,14 @@ class OSMMapRendering(object):
         @param state: True if the partitions are shown
         """
         self.__show_partitions = state
-    show_partitions = property(None, set_show_partitions, None, 'write-only property for the "show partitions" state') 
+    show_partitions = property(get_show_partitions, set_show_partitions, None, 'read/write-property for the "show partitions" state') 
+
+    def get_show_generalized(self):
+        """ Returns the tolerance value of the generalization that is used for the map display
+        
+        @returns: tolerance value of the shown generalization, 0 if no generalization is shown
+        """
+        return self.__show_generalized
 
     def set_show_generalized(self, tolerance):
         """ Sets the tolerance value of the generalization that will be used for the map display
@@ -377,7 +524,7 @@ class OSMMapRendering(object):
         @param tolerance: tolerance value of the generalization that will be used for the map display
         """
         self.__show_generalized = tolerance
-    show_generalized = property(None, set_show_generalized, None, 'write-only property for the generalization that will be displayed')
+    show_generalized = property(get_show_generalized, set_show_generalized, None, 'read/write-property for the generalization that will be displayed')
 
 #def main():
 #    gtk.main()
@@ -4,10 +4,19 @@ of a map displayed in the MoSP GeoTool.
 """
 
 from PIL import Image
-import StringIO
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import Queue
+import atexit
 import gtk
+import httplib
 import os
-import urllib
+import tempfile
+import urlparse
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
 
 __author__ = "C. Protsch"
 __maintainer__ = "B. Henne"
@@ -16,77 +25,468 @@ __copyright__ = "(c) 2011, DCSec, Leibniz Universitaet Hannover, Germany"
 __license__ = "GPLv3"
 
 TILE_SIZE = 256	#: pixel size of the OSM tiles
+TILE_HOST = 'a.tile.openstreetmap.org' #: host of the OSM tile server
+TILE_URL = '/%s/%s/%s.png' #: path of an OSM tile on the tile server, formatted with zoom level, x and y
+HEADERS = {'User-Agent': 'MoSP-GeoTool'} #: HTTP headers sent with every tile request
+REDIRECT_STATUSES = (301, 302, 303, 307, 308) #: HTTP status codes of redirects, which are followed to the C{Location} of the tile
+MAX_REDIRECTS = 5 #: maximum number of redirects followed for a single tile
+DOWNLOAD_THREADS = 2 #: number of threads that download missing and prefetched tiles, the OSM tile usage policy allows at most 2 connections
+PLACEHOLDER_DEPTH = 4 #: number of lower zoom levels searched for a cached tile that replaces a missing tile
+TILE_CACHE_SIZE = 512 #: default maximum number of decoded tiles kept in memory, a tile takes about 192 KB
+RAW_TILES = False #: if True, decoded tiles are also saved as raw RGB data (192 KB per tile) next to the PNG files and read from there instead of decoding the PNG files again
 path = '../data/osm-tiles/' #: path to the directory where the tiles are saved
 
-def background_from_tiles(tile_box, zoom_level):
+__connections = Queue.Queue() #: idle keep-alive connections to the tile server, shared by all download threads
+__tile_cache = OrderedDict() #: decoded tiles by (zoom level, x, y) in least recently used order
+__tile_cache_size = TILE_CACHE_SIZE #: maximum number of tiles in the tile cache, see L{set_tile_cache_size}
+__prefetching = set() #: (zoom level, x, y) of the tiles queued for prefetching or background loading
+__download_pool = None #: thread pool that loads missing tiles of the displayed map and the prefetched tiles in the background, created on first use
+__failed = set() #: (zoom level, x, y) of the tiles whose background download failed, they are not loaded again
+__awaited = set() #: (zoom level, x, y) of the missing tiles of the displayed map that are not downloaded yet
+__awaited_callback = None #: function called when all tiles in L{__awaited} have been downloaded, see L{background_from_tiles}
+__not_available = None #: decoded image shown for tiles that could not be downloaded, loaded on first use
+__writer = None #: single thread that saves downloaded tiles to disk, created on first use
+__background = None #: background image of the last call of L{background_from_tiles}, reused if the size doesn't change
+
+def __tile_paths(zoom_level, tile_x, tile_y):
+    """ Gets the local folder and file path of a tile
+    
+    @type zoom_level: C{int}
+    @param zoom_level: the OSM zoom level of the tile
+    @type tile_x: C{int}
+    @param tile_x: slippy map tilename in x direction
+    @type tile_y: C{int}
+    @param tile_y: slippy map tilename in y direction
+    @returns: the folder and the path of the tile file as a tuple C{(image_folder_path, image_path)}
+    @rtype: C{(str, str)}
+    """
+    image_folder_path = '%s%s/%s/' % (path, zoom_level, tile_x)
+    return image_folder_path, '%s%s.png' % (image_folder_path, tile_y)
+
+def __make_folder(image_folder_path):
+    """ Creates a tile folder, a folder created meanwhile by another thread is no error
+    
+    @type image_folder_path: C{str}
+    @param image_folder_path: path of the folder
+    """
+    try:
+        os.makedirs(image_folder_path)
+    except OSError:
+        if not os.path.isdir(image_folder_path):
+            raise
+
+def __fetch(remote_path):
+    """ Requests a tile from the tile server using a pooled keep-alive connection
+    
+    A connection that was closed by the server while idle is replaced by a new one once.
+    Redirects are followed by L{__fetch_redirected}, other responses than C{200 OK} are reported.
+    
+    @type remote_path: C{str}
+    @param remote_path: path of the tile on the tile server
+    @returns: the image data of the tile or C{None} if the server did not return the tile
+    @rtype: C{str}
+    """
+    try:
+        connection = __connections.get_nowait()
+        retry = True
+    except Queue.Empty:
+        connection = httplib.HTTPConnection(TILE_HOST)
+        retry = False
+    try:
+        connection.request('GET', remote_path, headers=HEADERS)
+        response = connection.getresponse()
+        data = response.read()
+    except (httplib.HTTPException, IOError):
+        connection.close()
+        if retry:
+            return __fetch(remote_path)
+        raise
+    __connections.put(connection)
+    if response.status in REDIRECT_STATUSES:
+        location = urlparse.urljoin('http://%s%s' % (TILE_HOST, remote_path), response.getheader('Location', ''))
+        return __fetch_redirected(location, MAX_REDIRECTS)
+    if response.status != httplib.OK:
+        print 'tile %s: HTTP %s %s' % (remote_path, response.status, response.reason)
+        return None
+    return data
+
+def __fetch_redirected(url, redirects):
+    """ Requests a tile from the location a tile request was redirected to
+    
+    Redirects lead to another host or to https, so a new connection is used for every request.
+    
+    @type url: C{str}
+    @param url: absolute URL of the tile
+    @type redirects: C{int}
+    @param redirects: number of further redirects that are followed
+    @returns: the image data of the tile or C{None} if the server did not return the tile
+    @rtype: C{str}
+    """
+    parts = urlparse.urlsplit(url)
+    if parts.scheme == 'https':
+        connection = httplib.HTTPSConnection(parts.netloc)
+    else:
+        connection = httplib.HTTPConnection(parts.netloc)
+    remote_path = parts.path or '/'
+    if parts.query:
+        remote_path += '?' + parts.query
+    try:
+        connection.request('GET', remote_path, headers=HEADERS)
+        response = connection.getresponse()
+        data = response.read()
+    finally:
+        connection.close()
+    if response.status in REDIRECT_STATUSES and redirects > 0:
+        return __fetch_redirected(urlparse.urljoin(url, response.getheader('Location', '')), redirects - 1)
+    if response.status != httplib.OK:
+        print 'tile %s: HTTP %s %s' % (url, response.status, response.reason)
+        return None
+    return data
+
+def __download_tile(remote_path):
+    """ Downloads a single OSM tile
+    
+    @type remote_path: C{str}
+    @param remote_path: path of the tile on the tile server
+    @returns: the image data of the tile or C{None} if the download failed
+    @rtype: C{str}
+    """
+    try:
+        return __fetch(remote_path)
+    except (httplib.HTTPException, IOError):
+        return None
+
+def __write_tile(image_path, data):
+    """ Writes the image data of a tile to the tile file
+    
+    @type image_path: C{str}
+    @param image_path: local path of the tile file
+    @type data: C{str}
+    @param data: image data of the tile
+    """
+    # write to a temporary file first, so no other thread can read a partially written tile
+    handle, temp_path = tempfile.mkstemp('.part', '', os.path.dirname(image_path))
+    tile_file = os.fdopen(handle, 'wb')
+    try:
+        tile_file.write(data)
+    finally:
+        tile_file.close()
+    os.rename(temp_path, image_path)
+
+def __close_writer():
+    """ Waits until all queued tiles have been saved, registered to run at exit """
+    __writer.close()
+    __writer.join()
+
+def __save_tile(image_path, data):
+    """ Queues the image data of a tile for being written to the tile file by the writer thread
+    
+    @type image_path: C{str}
+    @param image_path: local path of the tile file
+    @type data: C{str}
+    @param data: image data of the tile
+    """
+    global __writer
+    if __writer is None:
+        __writer = ThreadPool(1)
+        atexit.register(__close_writer)
+    __writer.apply_async(__write_tile, (image_path, data))
+
+def __prefetch_tile(key):
+    """ Downloads a single OSM tile into the tile folder if it doesn't already exist there
+    
+    @type key: C{(int, int, int)}
+    @param key: zoom level and slippy map tile name of the tile
+    @returns: C{False} if the tile had to be downloaded and the download failed
+    @rtype: C{bool}
+    """
+    try:
+        zoom_level, tile_x, tile_y = key
+        image_folder_path, image_path = __tile_paths(zoom_level, tile_x, tile_y)
+        if not os.access(image_path, os.F_OK):
+            __make_folder(image_folder_path)
+            data = __download_tile(TILE_URL % key)
+            if data is None:
+                return False
+            __write_tile(image_path, data)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        __prefetching.discard(key)
+
+def __load_tile(key):
+    """ Downloads a missing tile of the displayed map in the background, a failed download is remembered
+    
+    The callback of L{background_from_tiles} is called when the last awaited tile is done,
+    also if the tile has been queued by the prefetching.
+    
+    @type key: C{(int, int, int)}
+    @param key: zoom level and slippy map tile name of the tile
+    """
+    if __prefetch_tile(key):
+        try:
+            # only reads the header, detects files that are no images
+            Image.open(__tile_paths(*key)[1])
+        except IOError:
+            __failed.add(key)
+    else:
+        __failed.add(key)
+    if key in __awaited:
+        __awaited.discard(key)
+        callback = __awaited_callback
+        if not __awaited and callback is not None:
+            callback()
+
+def __prefetch_neighbours(tile_box, zoom_level):
+    """ Starts downloading the ring of tiles around the displayed ones in the background
+    
+    Only the ring at the current zoom level is prefetched, the OSM tile usage policy forbids bulk downloads.
+    The tiles are queued after the missing tiles of the displayed map on the same two download threads.
+    
+    @type tile_box: C{[(int, int), (int, int)]}
+    @param tile_box: slippy map tile names of the top/left tile and right/bottom tile of the displayed tiles
+    @type zoom_level: C{int}
+    @param zoom_level: the OSM zoomlevel of the displayed tiles
+    """
+    global __download_pool
+    (min_x, min_y), (max_x, max_y) = tile_box
+    
+    keys = []
+    # the ring around the box at the current zoom level
+    last = 2 ** zoom_level - 1
+    for tile_y in range(max(min_y - 1, 0), min(max_y + 1, last) + 1):
+        for tile_x in range(max(min_x - 1, 0), min(max_x + 1, last) + 1):
+            if not (min_x <= tile_x <= max_x and min_y <= tile_y <= max_y):
+                keys.append((zoom_level, tile_x, tile_y))
+    
+    # skip the tiles that are already in memory or queued by a previous call
+    keys = [key for key in keys if key not in __tile_cache and key not in __prefetching]
+    if not keys:
+        return
+    __prefetching.update(keys)
+    if __download_pool is None:
+        __download_pool = ThreadPool(DOWNLOAD_THREADS)
+    # the displayed map is notified if it waits for one of the tiles
+    __download_pool.map_async(__load_tile, keys)
+
+def __image_bytes(image):
+    """ Gets the raw pixel data of an image
+    
+    @type image: C{PIL.Image}
+    @param image: PIL image object
+    @returns: the raw pixel data
+    @rtype: C{str}
+    """
+    # Pillow renamed tostring to tobytes
+    if hasattr(image, 'tobytes'):
+        return image.tobytes()
+    return image.tostring()
+
+def __decode_tile(image_path, data=None):
+    """ Decodes a tile from the tile file, from its raw RGB file or from the downloaded image data
+    
+    @type image_path: C{str}
+    @param image_path: local path of the tile file
+    @type data: C{str}
+    @param data: downloaded image data of the tile, the tile file is read if not given
+    @returns: PIL image object of the tile in RGB mode
+    @rtype: C{PIL.Image}
+    """
+    raw_path = image_path + '.raw'
+    if data is None and RAW_TILES:
+        try:
+            raw_file = open(raw_path, 'rb')
+        except IOError:
+            pass
+        else:
+            try:
+                raw = raw_file.read()
+            finally:
+                raw_file.close()
+            if len(raw) == TILE_SIZE * TILE_SIZE * 3:
+                return Image.frombuffer("RGB", (TILE_SIZE, TILE_SIZE), raw, 'raw', "RGB", 0, 1)
+    
+    # decode the image now and convert it to the mode of the background,
+    # so pasting the tile is a plain copy of its pixels
+    if data is None:
+        tile = Image.open(image_path).convert("RGB")
+    else:
+        tile = Image.open(StringIO(data)).convert("RGB")
+    if RAW_TILES and tile.size == (TILE_SIZE, TILE_SIZE):
+        __save_tile(raw_path, __image_bytes(tile))
+    return tile
+
+def __get_tile(image_path, key, data=None):
+    """ Returns a decoded tile, either from the in-memory cache or by decoding it
+    
+    The least recently used tile is dropped if the cache is full. The tiles of the displayed map
+    are used on every redraw, so tiles that are not visible anymore are dropped first.
+    
+    @type image_path: C{str}
+    @param image_path: local path of the tile file
+    @type key: C{(int, int, int)}
+    @param key: zoom level and slippy map tile name of the tile
+    @type data: C{str}
+    @param data: downloaded image data of the tile, the tile file is read if not given
+    @returns: PIL image object of the tile
+    @rtype: C{PIL.Image}
+    """
+    tile = __tile_cache.pop(key, None)
+    if tile is None:
+        tile = __decode_tile(image_path, data)
+        if len(__tile_cache) >= __tile_cache_size:
+            __tile_cache.popitem(last=False)
+    # (re-)insert the tile as the most recently used one
+    __tile_cache[key] = tile
+    return tile
+
+def __get_placeholder_tile(key):
+    """ Returns the replacement for a tile that is not available (yet)
+    
+    The part of the nearest cached tile of a lower zoom level that covers the tile is scaled up.
+    If there is no such tile, the not-available image is used.
+    
+    @type key: C{(int, int, int)}
+    @param key: zoom level and slippy map tile name of the tile
+    @returns: PIL image object of the replacement tile
+    @rtype: C{PIL.Image}
+    """
+    zoom_level, tile_x, tile_y = key
+    for depth in range(1, min(PLACEHOLDER_DEPTH, zoom_level) + 1):
+        ancestor = __tile_cache.get((zoom_level - depth, tile_x >> depth, tile_y >> depth))
+        if ancestor is not None:
+            # the ancestor covers 2**depth x 2**depth tiles of the zoom level
+            size = TILE_SIZE >> depth
+            left = (tile_x & ((1 << depth) - 1)) * size
+            top = (tile_y & ((1 << depth) - 1)) * size
+            return ancestor.crop((left, top, left + size, top + size)).resize((TILE_SIZE, TILE_SIZE), Image.BILINEAR)
+    return __get_not_available_tile()
+
+def __get_not_available_tile():
+    """ Returns the decoded image that replaces tiles that could not be downloaded
+    
+    @returns: PIL image object of the replacement tile
+    @rtype: C{PIL.Image}
+    """
+    global __not_available
+    if __not_available is None:
+        __not_available = Image.open('%snot_available.png' % path).convert("RGB")
+    return __not_available
+
+def set_tile_cache_size(size):
+    """ Sets the maximum number of decoded tiles kept in memory
+    
+    The least recently used tiles are dropped if the cache holds more tiles.
+    
+    @type size: C{int}
+    @param size: maximum number of tiles
+    """
+    global __tile_cache_size
+    __tile_cache_size = max(size, 1)
+    while len(__tile_cache) > __tile_cache_size:
+        __tile_cache.popitem(last=False)
+
+def clear_tile_cache():
+    """ Drops all decoded tiles kept in memory and forgets the failed background downloads """
+    __tile_cache.clear()
+    __failed.clear()
+
+def background_from_tiles(tile_box, zoom_level, loaded=None):
     """ The method creates for an area given by a rectangular box of OSM tiles and an OSM zoom level a U{Python Imaging Library (PIL)<http://www.pythonware.com/products/pil/>} image.
 
     The rectangular box is given by the U{slippy map tilenames<http://wiki.openstreetmap.org/index.php/Slippy_map_tilenames>} of the OSM tiles of the top/left edge and the bottom/right edge.
     
+    The image object is reused by the next call of the method if the size of the box doesn't change,
+    so it has to be converted or copied before calling the method again.
+    
+    The image is returned at once with scaled up tiles of lower zoom levels in place of
+    the missing tiles, which are downloaded in the background. C{loaded} is called from
+    the download thread when they are available, the image has to be created again then.
+    Tiles whose background download failed are replaced without trying again.
+    
     @type tile_box: C{[(int, int), (int, int)]}
     @param tile_box: slippy map tile names of the top/left tile and right/bottom tile of a rectangular box in the format C{[(topleft_x, topleft_y), (bottomright_x, bottomright_y)]}
     @type zoom_level: C{int}
     @param zoom_level: the OSM zoomlevel of the background image
+    @type loaded: callable
+    @param loaded: function without arguments, called when the missing tiles have been downloaded in the background,
+        replaces the callback of the previous call
     
     @returns: PIL image object
     @rtype: C{PIL.Image}
     """
+    global __background, __download_pool, __awaited, __awaited_callback
     # tile_box: slippy map tile IDs [(left, top), (right, bottom)]
     
     d_tile_x, d_tile_y = [(tile_box[1][i] - tile_box[0][i] + 1) for i in range(2)]
     
-    zoom_path = '%s%s/' % (path, zoom_level)
-    
-    # create an empty RGB PIL image object with the correct size
-    background = Image.new("RGB", (d_tile_x * TILE_SIZE, d_tile_y * TILE_SIZE))
+    tiles = [] # (pos_x, pos_y, tile) of the cached or saved tiles
+    missing = [] # (remote_path, image_path, key, pos_x, pos_y) of the tiles that have to be downloaded
+    folders = set() # local folders of the tiles that have to be downloaded
     
-    pos_y = 0
-
-    # calculate the remote and local paths
-    for tile_y in range(tile_box[0][1], tile_box[1][1] + 1):
-        pos_x = 0
-        for tile_x in range(tile_box[0][0], tile_box[1][0] + 1):
-            image_folder_path = '%s%s/' % (zoom_path,tile_x)
-            image_path = '%s%s.png' % (image_folder_path, tile_y)
+    # get the cached or saved tiles and calculate the remote and local paths of the others
+    for pos_y, tile_y in enumerate(range(tile_box[0][1], tile_box[1][1] + 1)):
+        for pos_x, tile_x in enumerate(range(tile_box[0][0], tile_box[1][0] + 1)):
+            image_folder_path, image_path = __tile_paths(zoom_level, tile_x, tile_y)
+            key = (zoom_level, tile_x, tile_y)
             
-            # download the image only if it doesn't already exist
-            if not os.access(image_path,os.F_OK):
-                if not os.access(image_folder_path, os.F_OK):
-                    # create the local folders if they don't exist
-                    os.makedirs(image_folder_path)
-                remote_path = 'http://a.tile.openstreetmap.org/%s/%s/%s.png' % (zoom_level, tile_x, tile_y)
-                # download the image from remote_path and save it to image_path
-                try:
-                    urllib.urlretrieve (remote_path, image_path)
-                # use an empty image if the download failed
-                except IOError:
-                    image_path = '%snot_available.png' % path
-                    
-            # open the single tile image ...
-            tile = Image.open(image_path)
-            # ... and put it at the correct position of the created image
-            background.paste(tile, (pos_x * TILE_SIZE, pos_y* TILE_SIZE))
-                
-            pos_x += 1
-        pos_y += 1
+            try:
+                tiles.append((pos_x, pos_y, __get_tile(image_path, key)))
+            except IOError:
+                if key in __failed:
+                    tiles.append((pos_x, pos_y, __get_placeholder_tile(key)))
+                    continue
+                # download the image if it doesn't exist or can't be read
+                folders.add(image_folder_path)
+                remote_path = TILE_URL % (zoom_level, tile_x, tile_y)
+                missing.append((remote_path, image_path, key, pos_x, pos_y))
+    
+    # create the local folders if they don't exist, once per folder
+    for image_folder_path in folders:
+        __make_folder(image_folder_path)
+    
+    # create an uninitialized RGB PIL image object with the correct size unless the last one fits,
+    # every pixel is overwritten by a tile
+    size = (d_tile_x * TILE_SIZE, d_tile_y * TILE_SIZE)
+    if __background is None or __background.size != size:
+        __background = Image.new("RGB", size, None)
+    background = __background
+    
+    # PIL images are not thread-safe, only this thread pastes the tiles
+    for pos_x, pos_y, tile in tiles:
+        background.paste(tile, (pos_x * TILE_SIZE, pos_y* TILE_SIZE))
+    
+    # use placeholders and download the missing images in the background
+    for remote_path, image_path, key, pos_x, pos_y in missing:
+        background.paste(__get_placeholder_tile(key), (pos_x * TILE_SIZE, pos_y* TILE_SIZE))
+    keys = [key for remote_path, image_path, key, pos_x, pos_y in missing]
+    # only the tiles of the displayed map are awaited, tiles of a previous call are not anymore
+    __awaited = set(keys)
+    __awaited_callback = loaded
+    # tiles queued by a previous call or by the prefetching are not downloaded twice
+    keys = [key for key in keys if key not in __prefetching]
+    if keys:
+        __prefetching.update(keys)
+        if __download_pool is None:
+            __download_pool = ThreadPool(DOWNLOAD_THREADS)
+        __download_pool.map_async(__load_tile, keys)
+    
+    __prefetch_neighbours(tile_box, zoom_level)
     return background
 
 def pil_image_to_pixbuf(image):
     """ Converts a U{Python Imaging Library (PIL)<http://www.pythonware.com/products/pil/>} image to a U{GTK Pixbuf<http://developer.gnome.org/pygtk/stable/class-gdkpixbuf.html>}
     
-    @see: taken from U{http://faq.pygtk.org/index.py?req=show&file=faq08.007.htp}
-    @author: Sebastian Wilhelmi
+    The raw RGB data of the image is passed to the pixbuf directly instead of encoding
+    and decoding it as a PPM image.
+    
     @type image: C{PIL.Image}
     @param image: PIL image object that shall be converted
     @returns: a gtk.gdk.Pixbuf object of the image
     @rtype: C{gtk.gdk.Pixbuf}
     """
-    fd = StringIO.StringIO()
-    image.save(fd, "ppm")
-    contents = fd.getvalue()
-    fd.close()
-    loader = gtk.gdk.PixbufLoader("pnm")
-    loader.write(contents, len(contents))
-    pixbuf = loader.get_pixbuf()
-    loader.close()
-    return pixbuf
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    width, height = image.size
+    return gtk.gdk.pixbuf_new_from_data(__image_bytes(image), gtk.gdk.COLORSPACE_RGB, False, 8, width, height, width * 3)
@@ -25,7 +25,8 @@ def sec(x):
 
 def latlon2relativeXY(lat, lon):
     x = (lon + 180) / 360
-    y = (1 - log(tan(radians(lat)) + sec(radians(lat))) / pi) / 2
+    lat_rad = radians(lat)
+    y = (1 - log(tan(lat_rad) + 1 / cos(lat_rad)) / pi) / 2
     return(x, y)
 
 def latlon2xy(lat, lon, z):
@@ -3,7 +3,9 @@ displayed in the MoSP GeoTool
 @author: C. Protsch
 """
 
-from tilenames import tileXY, tileEdges
+from itertools import izip
+from math import cos, floor, log, pi, radians, tan
+from tilenames import latlon2relativeXY, tileXY, tileEdges
 
 __author__ = "C. Protsch"
 __maintainer__ = "B. Henne"
@@ -12,6 +14,7 @@ __copyright__ = "(c) 2011, DCSec, Leibniz Universitaet Hannover, Germany"
 __license__ = "GPLv3"
 
 TILE_SIZE = 256 #: pixel size of the OSM tiles
+CACHE_SIZE = 4096 #: maximum number of memoized results of tileXY and tileEdges each
 
 class ZoomObject(object):
     """ An instance of the ZoomObject class calculates and stores the dimensions of the displayed map
@@ -33,6 +36,49 @@ class ZoomObject(object):
         self.__window_width = width #: window width in pixels
         self.__window_height = height #: window height in pixels
         self.__zoom_level = 18	#: stores the OSM zoom level of the ZoomObject
+        self.__xy_cache = {} #: memoized results of tileXY by (lat, lon, zoom level)
+        self.__edges_cache = {} #: memoized results of tileEdges by (x, y, zoom level)
+        self.__update_zoom_cache()
+    
+    def __update_zoom_cache(self):
+        """ Updates the values that only depend on the zoom level, must be called after changing the zoom level """
+        self.__num_tiles = 2.0 ** self.__zoom_level #: number of tiles in each direction at the zoom level
+    
+    def __tile_xy(self, lat, lon):
+        """ Memoized version of tileXY at the zoom level of the ZoomObject
+        
+        @param lat: Geographic latitude of a point
+        @param lon: Geographic longitude of a point
+        @returns: slippy map tilename of the tile the point lies in
+        @rtype: C{(int, int)}
+        """
+        key = (lat, lon, self.__zoom_level)
+        try:
+            return self.__xy_cache[key]
+        except KeyError:
+            if len(self.__xy_cache) >= CACHE_SIZE:
+                self.__xy_cache.clear()
+            tile = self.__xy_cache[key] = tileXY(lat, lon, self.__zoom_level)
+            return tile
+    
+    def __tile_edges(self, x, y):
+        """ Memoized version of tileEdges at the zoom level of the ZoomObject
+        
+        @type x: C{int}
+        @param x: slippy map tilename in x direction
+        @type y: C{int}
+        @param y: slippy map tilename in y direction
+        @returns: Geographic coordinates of the edges of the tile
+        @rtype: (min_lat, min_lon, max_lat, max_lon)
+        """
+        key = (x, y, self.__zoom_level)
+        try:
+            return self.__edges_cache[key]
+        except KeyError:
+            if len(self.__edges_cache) >= CACHE_SIZE:
+                self.__edges_cache.clear()
+            edges = self.__edges_cache[key] = tileEdges(x, y, self.__zoom_level)
+            return edges
    
     def find_zoom_level(self, box):
         """ Finds for a given bounding box the best zoom level so that the box fits into the screen. 
@@ -42,34 +88,51 @@ class ZoomObject(object):
         """
         self.__selection_box = box #: initial bounding box
         
-        d_x, d_y = self.box_size_in_pixels(box)
+        # estimate the zoom level from the pixel size of the box at zoom level 0,
+        # the pixel size doubles with every zoom level
+        x1, y1 = latlon2relativeXY(box[3], box[0])
+        x2, y2 = latlon2relativeXY(box[1], box[2])
+        d_x, d_y = (x2 - x1) * TILE_SIZE, (y2 - y1) * TILE_SIZE
+        if d_x > 0 and d_y > 0:
+            fitting = int(floor(min(log(self.__window_width / d_x, 2), log(self.__window_height / d_y, 2))))
+            # start one level above the estimate, the pixel size within the tiles is
+            # calculated slightly differently and the loop below corrects the estimate
+            self.__zoom_level = max(0, min(self.__zoom_level, fitting + 1))
+        
+        tiles_zoom_level = self.get_box_tiles(box)
+        d_x, d_y = self.box_size_in_pixels(box, tiles_zoom_level)
         
         # decrease the zoom level until the box fits into the screen
         while d_x > self.__window_width or d_y > self.__window_height:
             self.__zoom_level -= 1
-            d_x, d_y = self.box_size_in_pixels(box)
+            tiles_zoom_level = self.get_box_tiles(box)
+            d_x, d_y = self.box_size_in_pixels(box, tiles_zoom_level)
             
-        self.__tiles_zoom_level = self.get_box_tiles(box) #: stores the U{slippy map tilenames<http://wiki.openstreetmap.org/index.php/Slippy_map_tilenames>} of the tiles that will be displayed in the windows of the MoSP-GeoTool
+        self.__update_zoom_cache()
+        self.__tiles_zoom_level = tiles_zoom_level #: stores the U{slippy map tilenames<http://wiki.openstreetmap.org/index.php/Slippy_map_tilenames>} of the tiles that will be displayed in the windows of the MoSP-GeoTool
         self.__d_tiles_x, self.__d_tiles_y = [(self.__tiles_zoom_level[1][i] - self.__tiles_zoom_level[0][i] + 1) for i in range(2)]
 
-    def box_size_in_pixels(self, box):
+    def box_size_in_pixels(self, box, tiles_zoom_level=None):
         """ Calculates for a given bounding box the pixel size of the box at the zoom level of the ZoomObject.
         
         @type box: C{[min_lat, min_lon, max_lat, max_lon]}
         @param box: OSM bounding box
+        @type tiles_zoom_level: C{[(int, int), (int, int)]}
+        @param tiles_zoom_level: the tiles of the box as returned by L{get_box_tiles}, calculated if not given
         @returns: the width and height of the bounding box in pixels as a tuple (width, height)
         @rtype: C{(int, int)}
         """
         # find the tiles of the box edges at a given zoom level
         # NW, SE
-        tiles_zoom_level = self.get_box_tiles(box)
+        if tiles_zoom_level is None:
+            tiles_zoom_level = self.get_box_tiles(box)
         
         # calculate the number of intersected tiles
         d_tiles_x, d_tiles_y = [(tiles_zoom_level[1][i] - tiles_zoom_level[0][i] + 1) for i in range(2)]
         
         # calculate the distance in pixels of the box edges
-        x1, y1 = self.get_position_in_tile(box[3], box[0])
-        x2, y2 = self.get_position_in_tile(box[1], box[2])
+        x1, y1 = self.__position_in_tile(box[3], box[0], tiles_zoom_level[0])
+        x2, y2 = self.__position_in_tile(box[1], box[2], tiles_zoom_level[1])
         d_x = d_tiles_x * TILE_SIZE - x1 - (TILE_SIZE - x2)
         d_y = d_tiles_y * TILE_SIZE - y1 - (TILE_SIZE - y2)
         return (d_x, d_y)
@@ -87,8 +150,8 @@ class ZoomObject(object):
         @returns: slippy map tile names of the top/left tile and right/bottom tile of a rectangular box in the format C{[(topleft_x, topleft_y), (bottomright_x, bottomright_y)]}
         @rtype: C{[(int, int), (int, int)]}
         """
-        return [tileXY(box[3], box[0], self.__zoom_level),
-                tileXY(box[1], box[2], self.__zoom_level)]
+        return [self.__tile_xy(box[3], box[0]),
+                self.__tile_xy(box[1], box[2])]
 
     def tile_box(self):
         """ Expands the bounding box to the next even tile box.
@@ -100,18 +163,19 @@ class ZoomObject(object):
         @rtype: [min_lon, min_lat, max_lon, max_lat]
         """ 
         (min_x, max_y), (max_x, min_y) = self.__tiles_zoom_level
-        while self.__d_tiles_x * TILE_SIZE < self.__window_width:
-            self.__d_tiles_x += 1 #: stores the number of displayed tiles in x-direction
-            max_x += 1
-        while self.__d_tiles_y * TILE_SIZE < self.__window_height:
-            self.__d_tiles_y += 1 #: stores the number of displayed tiles in y-direction
-            min_y += 1
+        # add the number of tiles missing to cover the window (rounded up) at once
+        extra_x = max(0, (self.__window_width + TILE_SIZE - 1) // TILE_SIZE - self.__d_tiles_x)
+        extra_y = max(0, (self.__window_height + TILE_SIZE - 1) // TILE_SIZE - self.__d_tiles_y)
+        self.__d_tiles_x += extra_x #: stores the number of displayed tiles in x-direction
+        max_x += extra_x
+        self.__d_tiles_y += extra_y #: stores the number of displayed tiles in y-direction
+        min_y += extra_y
         
         # recalculate the tiles that will be displayed
         self.__tiles_zoom_level = [(min_x, max_y), (max_x, min_y)]
         # calculate the geographic coordinates of the edges
-        s1, w1, n1, e1 = tileEdges(min_x, max_y, self.__zoom_level)
-        s2, w2, n2, e2 = tileEdges(max_x, min_y, self.__zoom_level)
+        s1, w1, n1, e1 = self.__tile_edges(min_x, max_y)
+        s2, w2, n2, e2 = self.__tile_edges(max_x, min_y)
         
         # calculate the expansion of the displayed tiles in pixels
         self.__box_pixel = (self.__d_tiles_x * TILE_SIZE, self.__d_tiles_y * TILE_SIZE) #: pixel size of the box spanned by the displayed tiles (width, height)
@@ -126,8 +190,8 @@ class ZoomObject(object):
         @returns: Geographic coordinates of the edges of the corresponding tile
         @rtype: (min_lat, min_lon, max_lat, max_lon)
         """
-        x, y = tileXY(lat, lon, self.__zoom_level)
-        return tileEdges(x, y, self.__zoom_level) # S, W, N, E
+        x, y = self.__tile_xy(lat, lon)
+        return self.__tile_edges(x, y) # S, W, N, E
     
     def get_position_in_tile(self, lat, lon):
         """ Calculates the position of a point within its tile.
@@ -137,7 +201,50 @@ class ZoomObject(object):
         @returns: the distance in pixels from the left and the top as a tuple (x, y)
         @rtype: C{(int, int)}
         """
-        s, w, n, e = self.get_tile_coordinates(lat, lon)
+        # calculate the tile like tileXY does
+        lat_rad = radians(lat)
+        num_tiles = self.__num_tiles
+        s, w, n, e = self.__tile_edges(int(num_tiles * ((lon + 180) / 360)),
+                                       int(num_tiles * ((1 - log(tan(lat_rad) + 1 / cos(lat_rad)) / pi) / 2)))
+        return (int(TILE_SIZE * (lon - w) / (e - w)), int(TILE_SIZE * (lat - n) / (s - n)))
+    
+    def get_positions_in_tile(self, lats, lons):
+        """ Calculates the positions of several points within their tiles.
+        
+        Gives the same results as calling L{get_position_in_tile} for every point,
+        but avoids the method call per point.
+        
+        @type lats: C{list}
+        @param lats: Geographic latitudes of the points
+        @type lons: C{list}
+        @param lons: Geographic longitudes of the points
+        @returns: the distances in pixels from the left and the top as a tuple of two lists (xs, ys)
+        @rtype: C{([int], [int])}
+        """
+        num_tiles = self.__num_tiles
+        tile_edges = self.__tile_edges
+        xs = []
+        ys = []
+        for lat, lon in izip(lats, lons):
+            lat_rad = radians(lat)
+            tile_x = int(num_tiles * ((lon + 180) / 360))
+            tile_y = int(num_tiles * ((1 - log(tan(lat_rad) + 1 / cos(lat_rad)) / pi) / 2))
+            s, w, n, e = tile_edges(tile_x, tile_y)
+            xs.append(int(TILE_SIZE * (lon - w) / (e - w)))
+            ys.append(int(TILE_SIZE * (lat - n) / (s - n)))
+        return (xs, ys)
+    
+    def __position_in_tile(self, lat, lon, tile):
+        """ Calculates the position of a point within a known tile.
+        
+        @param lat: Geographic latitude of a point
+        @param lon: Geographic longitude of a point
+        @type tile: C{(int, int)}
+        @param tile: slippy map tilename of the tile the point lies in
+        @returns: the distance in pixels from the left and the top as a tuple (x, y)
+        @rtype: C{(int, int)}
+        """
+        s, w, n, e = self.__tile_edges(tile[0], tile[1])
         x = int(TILE_SIZE * (lon - w) / (e - w))
         y = int(TILE_SIZE * (lat - n) / (s - n))
         return (x, y)
@@ -156,7 +263,7 @@ class ZoomObject(object):
         @returns: Geographic coordinates of the point as a tuple (lat, lon)
         @rtype: C{lat, lon)}
         """
-        s, w, n, e = tileEdges(tile_x, tile_y, self.__zoom_level)
+        s, w, n, e = self.__tile_edges(tile_x, tile_y)
         lat = y * (s - n) / TILE_SIZE + n
         lon = x * (e - w) / TILE_SIZE + w
         return (lat, lon)
@@ -168,7 +275,7 @@ class ZoomObject(object):
         @rtype: C{[min_lon, min_lat, max_lon, max_lat]}         
         """
         position_nw = self.get_position_in_tile(self.__selection_box[3], self.__selection_box[0])
-        (tile_w, tile_n) = tileXY(self.__selection_box[3], self.__selection_box[0], self.__zoom_level)
+        (tile_w, tile_n) = self.__tile_xy(self.__selection_box[3], self.__selection_box[0])
         tiles_x = (position_nw[0] + self.__window_width) / TILE_SIZE
         tiles_y = (position_nw[1] + self.__window_height) / TILE_SIZE
         x = TILE_SIZE - ((tiles_x + 1) * TILE_SIZE - (position_nw[0] + self.__window_width))
@@ -206,6 +313,7 @@ class ZoomObject(object):
     def zoom_in(self):
         """ Increases the zoom_level instance variable by one """
         self.__zoom_level += 1        
+        self.__update_zoom_cache()
     
     def zoom_out(self):
         pass
@@ -10,6 +10,8 @@ __contact__ = "henne@dcsec.uni-hannover.de"
 __copyright__ = "(c) 2011, DCSec, Leibniz Universitaet Hannover, Germany"
 __license__ = "GPLv3"
 
+ABOUT_MARKUP = ' <b>Mobile Security &amp; Privacy Simulator: Geo Tool</b> \n <i> by Carsten Protsch, Benjamin Henne</i> \n <a href="http://www.dcsec.uni-hannover.de/">Distributed Computing &amp; Security Group</a>, \n Leibniz Universität Hannover, Germany\n' #: Pango markup of the text shown in the About dialogue
+
 class AboutWindow(object):
     
     def __init__(self, parent):
@@ -18,8 +20,8 @@ class AboutWindow(object):
                                        gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
                                        (gtk.STOCK_OK, gtk.RESPONSE_ACCEPT))
         
-        label = gtk.Label(' <b>Mobile Security &amp; Privacy Simulator: Geo Tool</b> \n <i> by Carsten Protsch, Benjamin Henne</i> \n <a href="http://www.dcsec.uni-hannover.de/">Distributed Computing &amp; Security Group</a>, \n Leibniz Universität Hannover, Germany\n')
-        label.set_use_markup(True)
+        label = gtk.Label()
+        label.set_markup(ABOUT_MARKUP)
 
         generalize_window.vbox.pack_start(label)
         generalize_window.show_all()
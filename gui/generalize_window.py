@@ -30,9 +30,12 @@ class GeneralizeWindow(object):
         response = generalize_window.run()
         
         if response == gtk.RESPONSE_ACCEPT:
-            tolerance = int(tolerance_field.get_text())
-            if tolerance > 0:
-                self.__tolerance = tolerance
+            # ignore input that is no positive integer instead of raising a ValueError
+            text = tolerance_field.get_text().strip()
+            if text.isdigit():
+                tolerance = int(text)
+                if tolerance > 0:
+                    self.__tolerance = tolerance
         
         generalize_window.destroy()
         
@@ -4,17 +4,19 @@ Start this module to run the MoSP GeoTool.
 @author: C. Protsch
 """
 
-from geo.osm_export import OSM_export
-from geo.osm_import import OSM_objects
-from geo.osm_map_rendering import OSMMapRendering
+# the modules of the OSM data representation, the map rendering and the algorithms
+# are imported when they are used first, so the window shows up without loading them
 from poi_window import PoiSelectionWindow, PoiConnectionWindow
-import app.poi
 import gtk
 import pygtk
 from gui.partition_window import PartitionConnectionWindow, FilterWindow
 from gui.generalize_window import GeneralizeWindow
 from gui.about_window import AboutWindow
-from app.generalize import generalize
+from functools import partial
+import gobject
+import os
+import threading
+import traceback
 pygtk.require("2.0")
 
 __author__ = "C. Protsch"
@@ -30,8 +32,9 @@ __license__ = "GPLv3"
 #HEIGHT = int(height * .8)
 
 MAIN_MONITOR = 0 #: 0 = primary monitor, 1 = secondary monitor, has to be 0 in single monitor mode
-WIDTH = int(gtk.gdk.screen_get_default().get_monitor_geometry(MAIN_MONITOR).width * .8)
-HEIGHT = int(gtk.gdk.screen_get_default().get_monitor_geometry(MAIN_MONITOR).height * .8)
+__monitor_geometry = gtk.gdk.screen_get_default().get_monitor_geometry(MAIN_MONITOR)
+WIDTH = int(__monitor_geometry.width * .8)
+HEIGHT = int(__monitor_geometry.height * .8)
 
 #WIDTH = int(gtk.gdk.screen_width()*.8)
 #HEIGHT = int(gtk.gdk.screen_height()*.8)
@@ -41,6 +44,54 @@ HEIGHT = int(gtk.gdk.screen_get_default().get_monitor_geometry(MAIN_MONITOR).hei
 
 MENU_HEIGHT = 50
 
+#: GtkBuilder file with the window and the menu of the MoSP GeoTool
+UI_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main_window.ui')
+
+#: number of ways that are generalized between two updates of the GUI when a generalization is applied
+APPLY_BATCH_SIZE = 100
+
+#: delay in milliseconds after which the arrow key presses collected so far move the map
+PAN_DELAY = 16
+
+#: sensitivity of the menu items in the states of the MoSP GeoTool, items not listed for a state keep their sensitivity
+MENU_STATES = {
+    'no_data': {'open': True, 'save': False, 'save_as': False, 'close': False,
+                'edit': False, 'zoom_in': False, 'zoom_out': False,
+                'connect_poi': False, 'apply_filter': False, 'remove_filter': False,
+                'generalized': False, 'apply_generalization': False,
+                'show_tiles': True, 'show_partitions': True},
+    'loading': {'open': False, 'save': False, 'save_as': False, 'close': False,
+                'edit': False, 'zoom_in': False, 'zoom_out': False, 'generalized': False,
+                'show_tiles': False, 'show_partitions': False},
+    'loaded': {'open': True, 'save': True, 'save_as': True, 'close': True,
+               'edit': True, 'zoom_in': True, 'zoom_out': True,
+               'show_tiles': True, 'show_partitions': True,
+               'select_poi': True, 'connect_poi': False, 'connect_partitions': True,
+               'filter_streets': True, 'apply_filter': False, 'remove_filter': False,
+               'remove_nodes': True, 'generalize': True, 'generalized': False,
+               'apply_generalization': False},
+    'poi_selected': {'connect_poi': True, 'connect_partitions': False, 'filter_streets': False,
+                     'apply_filter': False, 'remove_filter': False, 'generalize': False,
+                     'apply_generalization': False, 'remove_nodes': False},
+    'poi_connected': {'connect_partitions': True, 'filter_streets': True, 'apply_filter': False,
+                      'remove_filter': False, 'generalize': True, 'apply_generalization': False,
+                      'remove_nodes': True},
+    'filter_active': {'filter_streets': False, 'apply_filter': True, 'remove_filter': True,
+                      'select_poi': False, 'connect_poi': False, 'connect_partitions': False,
+                      'generalize': False, 'apply_generalization': False, 'remove_nodes': False},
+    'filter_done': {'filter_streets': True, 'apply_filter': False, 'remove_filter': False,
+                    'select_poi': True, 'connect_poi': False, 'connect_partitions': True,
+                    'generalize': True, 'apply_generalization': False, 'remove_nodes': True},
+    'generalized': {'generalized': True, 'apply_generalization': True,
+                    'select_poi': False, 'connect_poi': False, 'connect_partitions': False,
+                    'filter_streets': False, 'apply_filter': False, 'remove_filter': False,
+                    'remove_nodes': False},
+    'generalization_applied': {'generalized': False, 'apply_generalization': False,
+                               'select_poi': True, 'connect_poi': False, 'connect_partitions': True,
+                               'filter_streets': True, 'apply_filter': False, 'remove_filter': False,
+                               'remove_nodes': True},
+}
+
 class MainWindow(object):
     """ Main window of the MoSP GeoTool """
     def __init__(self):
@@ -51,173 +102,87 @@ class MainWindow(object):
         self.__active_filename = ''
         self.__active_osm_object = None
         self.__map = None
-        self.__poi_items = []
+        self.__area = None              # the map widget of the current map, see OSMMapRendering.getArea
+        self.__poi_items = set()       # (key, value) pairs of the POI selections
         self.__changed = False
+        self.__loading = False
+        self.__applying = False         # True while the generalization is applied in idle batches
+        self.__pbf_supported = None     # whether the OSMPBF extension can be loaded, checked on first use
+        self.__pending_pan = [0, 0]     # arrow key movement that is not yet applied to the map
+        self.__pan_scheduled = False
+        self.__gen_list = None          # submenu with the generalizations that can be shown
+        self.__gen_items = {}           # radio menu items of the submenu by tolerance
 
         # configure the window, menu, etc.
-        self.__main_window = gtk.Window()
-        self.__main_window.connect("destroy", lambda w: gtk.main_quit())
-        #self.__main_window.connect("destroy", self.__on_quit)
-        self.__main_window.connect('key_press_event', self.__on_key_press_event)
-        self.__main_window.set_title("MoSP-GeoTool")
+        # the window and the menu are declared in the GtkBuilder file UI_FILE
+        builder = gtk.Builder()
+        builder.add_from_file(UI_FILE)
+        builder.connect_signals({'on_destroy': lambda w: gtk.main_quit(),
+                                 'on_key_press_event': self.__on_key_press_event,
+                                 'on_open': self.__on_open,
+                                 'on_save': self.__on_save,
+                                 'on_save_as': self.__on_save_as,
+                                 'on_close': self.__on_close,
+                                 'on_quit': self.__on_quit,
+                                 'on_select_poi': self.__on_select_poi,
+                                 'on_connect_poi': self.__on_connect_poi,
+                                 'on_connect_partitions': self.__on_connect_partitions,
+                                 'on_filter_streets': self.__on_filter_streets,
+                                 'on_apply_filter': self.__on_apply_filter,
+                                 'on_remove_filter': self.__on_remove_filter,
+                                 'on_generalize': self.__on_generalize,
+                                 'on_apply_generalization': self.__on_apply_generalization,
+                                 'on_remove_nodes': self.__on_remove_nodes,
+                                 'on_show_tiles': self.__on_show_tiles,
+                                 'on_show_partitions': self.__on_show_partitions,
+                                 'on_zoom_in': self.__on_zoom_in,
+                                 'on_zoom_out': self.__on_zoom_out,
+                                 'on_about': self.__on_about})
+        
+        self.__main_window = builder.get_object('main_window')
         #self.__main_window.set_default_size(WIDTH, HEIGHT)
         self.__main_window.set_size_request(WIDTH, HEIGHT)
-        self.__main_window.set_resizable(True)
-        
-        accel_group = gtk.AccelGroup()
-        self.__main_window.add_accel_group(accel_group)
-        
-        menubar = gtk.MenuBar()
-        menubar.set_size_request(WIDTH, MENU_HEIGHT)
-
-        ###### Menu 'File' ######
-        file_item = gtk.MenuItem("_File")
-        file_item_sub = gtk.Menu()
-        open = gtk.MenuItem("_Open...")
-        self.__save = gtk.MenuItem("_Save")
-        self.__save_as = gtk.MenuItem("Save _As...")
-        self.__close = gtk.MenuItem("_Close")
-        quit = gtk.MenuItem("_Exit")
-        if self.__active_filename == '':
-            self.__save.set_sensitive(False)
-            self.__save_as.set_sensitive(False)
-            self.__close.set_sensitive(False)
-        file_item_sub.append(open)
-        file_item_sub.append(self.__save)
-        file_item_sub.append(self.__save_as)
-        file_item_sub.append(self.__close)
-        file_item_sub.append(quit)
-        file_item.set_submenu(file_item_sub)
-
-        open.connect("activate", self.__on_open)
-        open.add_accelerator("activate", accel_group, ord("O"),
-                             gtk.gdk.CONTROL_MASK, gtk.ACCEL_VISIBLE)
-        self.__save.connect("activate", self.__on_save)
-        self.__save.add_accelerator("activate", accel_group, ord("S"),
-                                    gtk.gdk.CONTROL_MASK, gtk.ACCEL_VISIBLE)
-        self.__save_as.connect("activate", self.__on_save_as)
-        self.__close.connect("activate", self.__on_close)
-        self.__close.add_accelerator("activate", accel_group, ord("W"),
-                                     gtk.gdk.CONTROL_MASK, gtk.ACCEL_VISIBLE)
-        quit.connect("activate", self.__on_quit)
-        quit.add_accelerator("activate", accel_group, ord("Q"),
-                             gtk.gdk.CONTROL_MASK, gtk.ACCEL_VISIBLE)
-
-        menubar.append(file_item)
-
-
-        ###### Menu 'Edit' ######
-        self.__edit_item = gtk.MenuItem("_Edit")
-        edit_item_sub = gtk.Menu()
-        self.__select_poi = gtk.MenuItem("_Select POIs...")
-        self.__connect_poi = gtk.MenuItem("_Connect POIs...")
-        self.__connect_poi.set_sensitive(False)
-        self.__connect_partitions = gtk.MenuItem("Connect _Partitions...")
-        self.__filter_streets = gtk.MenuItem("_Filter Streets...")
-        self.__apply_filter = gtk.MenuItem("Apply Street Filter")
-        self.__apply_filter.set_sensitive(False)
-        self.__remove_filter = gtk.MenuItem("Remove Street Filter")
-        self.__remove_filter.set_sensitive(False)
-        self.__generalize = gtk.MenuItem("_Generalize...")
-        self.__apply_generalization = gtk.MenuItem("_Apply Generalization")
-        self.__apply_generalization.set_sensitive(False)
-        self.__remove_nodes = gtk.MenuItem("Remove Unused Nodes")
-        edit_item_sub.append(self.__select_poi)
-        edit_item_sub.append(self.__connect_poi)
-        edit_item_sub.append(gtk.SeparatorMenuItem())
-        edit_item_sub.append(self.__connect_partitions)
-        edit_item_sub.append(self.__filter_streets)
-        edit_item_sub.append(self.__apply_filter)
-        edit_item_sub.append(self.__remove_filter)        
-        edit_item_sub.append(gtk.SeparatorMenuItem())
-        edit_item_sub.append(self.__generalize)
-        edit_item_sub.append(self.__apply_generalization)
-        edit_item_sub.append(gtk.SeparatorMenuItem())
-        edit_item_sub.append(self.__remove_nodes)
-        self.__edit_item.set_submenu(edit_item_sub)
-        if self.__active_filename == '':
-            self.__edit_item.set_sensitive(False)
-
-        self.__select_poi.connect("activate", self.__on_select_poi)
-        self.__connect_poi.connect("activate", self.__on_connect_poi)
-        self.__connect_partitions.connect("activate", self.__on_connect_partitions)
-        self.__filter_streets.connect("activate", self.__on_filter_streets)
-        self.__apply_filter.connect("activate", self.__on_apply_filter)
-        self.__remove_filter.connect("activate", self.__on_remove_filter)
-        self.__generalize.connect("activate", self.__on_generalize)
-        self.__apply_generalization.connect("activate", self.__on_apply_generalization)
-        self.__remove_nodes.connect("activate", self.__on_remove_nodes)
-
-        menubar.append(self.__edit_item)
-
-
-        ###### Menu 'View' ######
-        view_item = gtk.MenuItem("_View")
-        view_item_sub = gtk.Menu()
-        self.__show_tiles = gtk.CheckMenuItem("Show OSM-_Tiles")
-        self.__show_partitions = gtk.CheckMenuItem("Show _Partitions")
-        self.__zoom_in = gtk.MenuItem("Zoom _In")
-        self.__zoom_out = gtk.MenuItem("Zoom _Out")
-        
-        self.__generalized = gtk.MenuItem('Show _Generalization')
-        self.__generalized.set_sensitive(False)
+        builder.get_object('menubar').set_size_request(WIDTH, MENU_HEIGHT)
         
-        view_item_sub.append(self.__show_tiles)
-        view_item_sub.append(self.__show_partitions)
-        view_item_sub.append(gtk.SeparatorMenuItem())
-        view_item_sub.append(self.__zoom_in)
-        view_item_sub.append(self.__zoom_out)
-        view_item_sub.append(gtk.SeparatorMenuItem())
-        view_item_sub.append(self.__generalized)
-        view_item.set_submenu(view_item_sub)
-        if self.__active_filename == '':
-            self.__zoom_in.set_sensitive(False)
-            self.__zoom_out.set_sensitive(False)
-
-        self.__show_tiles.connect("toggled", self.__on_show_tiles)
-        self.__show_tiles.add_accelerator("activate", accel_group, ord("t"),
-                                          0, gtk.ACCEL_VISIBLE)
-        self.__show_partitions.connect("toggled", self.__on_show_partitions)
-        self.__show_partitions.add_accelerator("activate", accel_group, ord("p"),
-                                          0, gtk.ACCEL_VISIBLE)
-        self.__zoom_in.connect("activate", self.__on_zoom_in)
-        self.__zoom_in.add_accelerator("activate", accel_group, ord("+"),
-                                       0, gtk.ACCEL_VISIBLE)
-        self.__zoom_out.connect("activate", self.__on_zoom_out)
-        self.__zoom_out.add_accelerator("activate", accel_group, ord("-"),
-                                        0, gtk.ACCEL_VISIBLE)
-
-        menubar.append(view_item)
-
-
-        ###### Menu 'Help' ######        
-        help_item = gtk.MenuItem("_Help")        
-        help_item_sub = gtk.Menu()
-        about = gtk.MenuItem("_About")
-        help_item_sub.append(about)
-        help_item.set_submenu(help_item_sub)
-
-        about.connect("activate", self.__on_about)
-
-        menubar.append(help_item)
+        self.__show_tiles = builder.get_object('show_tiles')
+        self.__show_partitions = builder.get_object('show_partitions')
+        self.__apply_generalization = builder.get_object('apply_generalization')
+        self.__generalized = builder.get_object('generalized')
         
+        # the menu items whose sensitivity depends on the state, see MENU_STATES
+        self.__menu_items = dict((name, builder.get_object(name))
+                                 for state in MENU_STATES.itervalues() for name in state)
+        self.__set_menu_state('no_data')
 
-        self.__vbox = gtk.VBox()
-        self.__vbox.pack_start(menubar)
+        self.__vbox = builder.get_object('vbox')
         
         self.__no_data = gtk.Label('no data loaded')
+        self.__loading_data = gtk.Label('loading data...')
+        self.__loading_data.set_size_request(WIDTH, HEIGHT)
         self.__map_container = self.__no_data
         #self.__map_container.set_size_request(self.__main_window.get_size()[0], self.__main_window.get_size()[1]-MENU_HEIGHT)
         self.__map_container.set_size_request(WIDTH, HEIGHT)
         self.__vbox.pack_start(self.__map_container)
 
-        self.__main_window.add(self.__vbox)
         self.__main_window.show_all()
     
         self.__last_key = None
+        # the actions of the keys that are not menu accelerators by key value,
+        # '+' and '-' are already covered by the accelerator keys
+        self.__key_actions = {gtk.keysyms.i: self.__on_zoom_in,
+                              gtk.keysyms.o: self.__key_zoom_out,
+                              gtk.keysyms.Left: partial(self.__key_move, 'Left'),
+                              gtk.keysyms.Right: partial(self.__key_move, 'Right'),
+                              gtk.keysyms.Up: partial(self.__key_move, 'Up'),
+                              gtk.keysyms.Down: partial(self.__key_move, 'Down'),
+                              gtk.keysyms.T: partial(self.__key_toggle, self.__show_tiles),
+                              gtk.keysyms.P: partial(self.__key_toggle, self.__show_partitions)}
     
     def __on_open(self, widget=None):
         
+        if self.__loading:
+            return
+        
         if self.__changed:
                 self.__save_message(widget)
 
@@ -236,13 +201,22 @@ class MainWindow(object):
         filter.set_name('OSM file')
         filter.add_mime_type('text/xml')
         filter.add_pattern('*.osm')
+        # large extracts are read much faster from the binary PBF format,
+        # the OSMPBF extension has to be built for this platform though
+        if self.__pbf_supported is None:
+            try:
+                from imposm_mod.parser.pbf import OSMPBF
+                self.__pbf_supported = True
+            except ImportError:
+                self.__pbf_supported = False
+        if self.__pbf_supported:
+            filter.add_pattern('*.pbf')
         open_dialog.add_filter(filter)
         
         # start the dialog
         open_dialog_response = open_dialog.run()
         
-        # start file import and rendering
-        # TODO: show something like a progress bar if a large map is opened
+        # start file import in the background, the map is rendered when the import has finished
         if open_dialog_response == gtk.RESPONSE_OK:
             filename = open_dialog.get_filename()
             self.__path = open_dialog.get_current_folder()
@@ -251,16 +225,71 @@ class MainWindow(object):
             # TODO: check if the old map has been saved
             if self.__map_container:
                 self.__vbox.remove(self.__map_container)
+            self.__map_container = self.__loading_data
+            self.__vbox.pack_start(self.__map_container)
+            self.__main_window.show_all()
+            self.__active_osm_object = None
+            self.__map = None
+            self.__area = None
+            
+            # deactivate the menu items until the map is loaded
+            self.__loading = True
+            self.__set_menu_state('loading')
             
-            self.__active_osm_object = OSM_objects(filename)
-            self.__active_osm_object.parse()
+            loader = threading.Thread(target=self.__load, args=(filename,))
+            loader.daemon = True
+            loader.start()
+ 
+        # close the dialog
+        open_dialog.destroy()
+    
+    def __load(self, filename):
+        """ Imports an OSM file, runs in a background thread
+        
+        The result is passed to L{__finish_open} in the GTK main loop.
+        
+        @type filename: C{str}
+        @param filename: path of the OSM file
+        """
+        try:
+            # importing the module in the background thread keeps the window responsive as well
+            from geo.osm_import import OSM_objects
+            osm_object = OSM_objects(filename)
+            osm_object.parse()
+        except Exception:
+            traceback.print_exc()
+            osm_object = None
+        gobject.idle_add(self.__finish_open, osm_object, filename)
+    
+    def __finish_open(self, osm_object, filename):
+        """ Renders an imported OSM file, called in the GTK main loop when L{__load} has finished
+        
+        @type osm_object: L{geo.osm_import.OSM_objects}
+        @param osm_object: the imported OSM data or C{None} if the import failed
+        @type filename: C{str}
+        @param filename: path of the OSM file
+        @returns: C{False}, so the idle callback is removed
+        @rtype: C{bool}
+        """
+        self.__loading = False
+        self.__vbox.remove(self.__map_container)
+        
+        if osm_object is None:
+            self.__map_container = self.__no_data
+            self.__vbox.pack_start(self.__map_container)
+            self.__main_window.show_all()
+            self.__active_filename = ''
+            self.__set_menu_state('no_data')
+        else:
+            self.__active_osm_object = osm_object
             #self.__partitions = PartitionFinder(self.__active_osm_object)
             #self.__map = OSMMapRendering(self.__active_osm_object, (self.__main_window.get_size()[0],self.__main_window.get_size()[1]-MENU_HEIGHT))
             #self.__map = OSMMapRendering(self.__active_osm_object, self.__partitions, (WIDTH, HEIGHT))
+            from geo.osm_map_rendering import OSMMapRendering
             self.__map = OSMMapRendering(self.__active_osm_object, (WIDTH, HEIGHT))
-            self.__show_tiles.set_active(False)
-            self.__show_partitions.set_active(False)
-            self.__map_container = self.__map.getArea()
+            self.__area = self.__map.getArea()
+            self.__reset_map_settings()
+            self.__map_container = self.__area
             self.__vbox.pack_start(self.__map_container)
             self.__main_window.show_all()
             self.__map_container.set_vadjustment(self.__map.vadj)
@@ -268,29 +297,19 @@ class MainWindow(object):
             self.__active_filename = filename
             
             # activate the disabled menu items
-            self.__save.set_sensitive(True)
-            self.__save_as.set_sensitive(True)
-            self.__close.set_sensitive(True)
-            self.__edit_item.set_sensitive(True)
-            self.__zoom_in.set_sensitive(True)
-            self.__zoom_out.set_sensitive(True)
-            
-            self.__select_poi.set_sensitive(True)
-            self.__connect_poi.set_sensitive(False)
-            self.__connect_partitions.set_sensitive(True)
-            self.__filter_streets.set_sensitive(True)
-            self.__apply_filter.set_sensitive(False)
-            self.__remove_filter.set_sensitive(False)
-            self.__remove_nodes.set_sensitive(True)
-            self.__generalize.set_sensitive(True)
-            self.__generalized.set_sensitive(False)
-            self.__apply_generalization.set_sensitive(False)
- 
-        # close the dialog
-        open_dialog.destroy()
+            self.__set_menu_state('loaded')
+        return False
     
     def __on_save(self, widget=None):
         assert self.__active_filename != ''
+        # the file already contains the data if nothing has been changed since it was opened or saved
+        if not self.__changed:
+            return
+        # the data is always exported as XML, a PBF file must not be overwritten with it
+        if self.__active_filename.endswith('.pbf'):
+            self.__on_save_as()
+            return
+        from geo.osm_export import OSM_export
         OSM_export(self.__active_filename, self.__active_osm_object)
         self.__changed = False
     
@@ -313,6 +332,7 @@ class MainWindow(object):
         save_dialog_response = save_dialog.run()
         if save_dialog_response == gtk.RESPONSE_OK:
             filename = save_dialog.get_filename()
+            from geo.osm_export import OSM_export
             OSM_export(filename, self.__active_osm_object)
             self.__changed = False
 
@@ -331,20 +351,15 @@ class MainWindow(object):
             self.__main_window.show_all()
             self.__active_osm_object = None
             self.__map = None
+            self.__area = None
             self.__partitions = None
             self.__changed = False
+            from geo.tile_image import clear_tile_cache
+            clear_tile_cache()
+            self.__reset_map_settings()
             
             # deactivate some menu items
-            self.__save.set_sensitive(False)
-            self.__save_as.set_sensitive(False)
-            self.__close.set_sensitive(False)
-            self.__edit_item.set_sensitive(False)
-            self.__zoom_in.set_sensitive(False)
-            self.__zoom_out.set_sensitive(False)
-            self.__generalized.set_sensitive(False)
-            self.__apply_generalization.set_sensitive(False)
-            self.__show_tiles.set_active(False)
-            self.__show_partitions.set_active(False)
+            self.__set_menu_state('no_data')
     
     def __on_quit(self, widget=None):
         if self.__changed:
@@ -362,27 +377,36 @@ class MainWindow(object):
             if delete_result == gtk.RESPONSE_YES:
                 gtk.main_quit()
 
+    def __redraw_after(handler):
+        """ Decorator for the handlers that change the map, queues one redraw of the map after the handler returned
+        
+        @param handler: the handler method
+        @returns: the wrapped handler
+        """
+        def redraw_handler(self, *args, **kwargs):
+            result = handler(self, *args, **kwargs)
+            if self.__map:
+                self.__area.queue_draw()
+            return result
+        redraw_handler.__name__ = handler.__name__
+        redraw_handler.__doc__ = handler.__doc__
+        return redraw_handler
+
+    @__redraw_after
     def __on_select_poi(self, widget=None):
         if self.__map:
             poi_selec = PoiSelectionWindow(self.__main_window)
             selection = poi_selec.get_selection()
             if selection:
-                self.__poi_items.append(selection)
-                self.__poi = app.poi.Poi(self.__active_osm_object)
+                self.__poi_items.add(selection)
+                from app.poi import Poi
+                self.__poi = Poi(self.__active_osm_object)
                 if self.__poi.get_poi(self.__poi_items):
                     self.__map.show_poi = True
-                    self.__map.getArea().queue_draw()
                     
-                    self.__connect_poi.set_sensitive(True)
-                    
-                    self.__connect_partitions.set_sensitive(False)
-                    self.__filter_streets.set_sensitive(False)
-                    self.__apply_filter.set_sensitive(False)
-                    self.__remove_filter.set_sensitive(False)
-                    self.__generalize.set_sensitive(False)
-                    self.__apply_generalization.set_sensitive(False)
-                    self.__remove_nodes.set_sensitive(False)
+                    self.__set_menu_state('poi_selected')
 
+    @__redraw_after
     def __on_connect_poi(self, widget=None):
         if self.__map:
             poi_connect = PoiConnectionWindow(self.__main_window)
@@ -391,25 +415,21 @@ class MainWindow(object):
                 self.__poi.connect_poi(poi_thresholds)
                 self.__changed = True
                 self.__active_osm_object.get_partitions().recalculate = True
-                self.__map.getArea().queue_draw()
+                self.__map.invalidate()
                 
-                self.__connect_partitions.set_sensitive(True)
-                self.__filter_streets.set_sensitive(True)
-                self.__apply_filter.set_sensitive(False)
-                self.__remove_filter.set_sensitive(False)
-                self.__generalize.set_sensitive(True)
-                self.__apply_generalization.set_sensitive(False)
-                self.__remove_nodes.set_sensitive(True)
+                self.__set_menu_state('poi_connected')
 
+    @__redraw_after
     def __on_connect_partitions(self, widget=None):
         if self.__map:
             partition_connect = PartitionConnectionWindow(self.__main_window)
             partition_thresholds = partition_connect.get_connection_thresholds()
             if partition_thresholds:
                 self.__active_osm_object.get_partitions().connect_partitions(partition_thresholds)
-                self.__map.getArea().queue_draw()
+                self.__map.invalidate()
                 self.__changed = True
 
+    @__redraw_after
     def __on_filter_streets(self, widget=None):
         if self.__map:
             filter_window = FilterWindow(self.__main_window)
@@ -417,54 +437,30 @@ class MainWindow(object):
             if street_filter:
                 filtered = self.__active_osm_object.get_partitions().filter_streets(street_filter)
                 if filtered:
+                    self.__map.invalidate()
                     self.__show_partitions.set_active(True)
                     self.__toggle_partitions()
                     
-                    self.__filter_streets.set_sensitive(False)
-                    self.__apply_filter.set_sensitive(True)
-                    self.__remove_filter.set_sensitive(True)
-                    
-                    self.__select_poi.set_sensitive(False)
-                    self.__connect_poi.set_sensitive(False)
-                    self.__connect_partitions.set_sensitive(False)
-                    self.__generalize.set_sensitive(False)
-                    self.__apply_generalization.set_sensitive(False)
-                    self.__remove_nodes.set_sensitive(False)
+                    self.__set_menu_state('filter_active')
 
+    @__redraw_after
     def __on_apply_filter(self, widget=None):
         if self.__map:
             self.__active_osm_object.get_partitions().remove_filtered_streets()
-            self.__map.getArea().queue_draw()
+            self.__map.invalidate()
             
             self.__changed = True
 
-            self.__filter_streets.set_sensitive(True)
-            self.__apply_filter.set_sensitive(False)
-            self.__remove_filter.set_sensitive(False)
-            
-            self.__select_poi.set_sensitive(True)
-            self.__connect_poi.set_sensitive(False)
-            self.__connect_partitions.set_sensitive(True)
-            self.__generalize.set_sensitive(True)
-            self.__apply_generalization.set_sensitive(False)
-            self.__remove_nodes.set_sensitive(True)
+            self.__set_menu_state('filter_done')
             
+    @__redraw_after
     def __on_remove_filter(self, widget=None):
         if self.__map:
             self.__active_osm_object.get_partitions().reset_partitions()
             self.__active_osm_object.get_partitions().find_partitions()
-            self.__map.getArea().queue_draw()
+            self.__map.invalidate()
             
-            self.__filter_streets.set_sensitive(True)
-            self.__apply_filter.set_sensitive(False)
-            self.__remove_filter.set_sensitive(False)
-            
-            self.__select_poi.set_sensitive(True)
-            self.__connect_poi.set_sensitive(False)
-            self.__connect_partitions.set_sensitive(True)
-            self.__generalize.set_sensitive(True)
-            self.__apply_generalization.set_sensitive(False)
-            self.__remove_nodes.set_sensitive(True)
+            self.__set_menu_state('filter_done')
                             
     def __on_generalize(self, widget=None):
         if self.__map:
@@ -472,31 +468,28 @@ class MainWindow(object):
             tolerance = gw.get_tolerance()
             if tolerance:
                 print 'tolerance:', tolerance
+                from app.generalize import generalize
                 generalize(self.__active_osm_object, tolerance)
                 
-                self.__gen_list = gtk.Menu()
-                default_item = gtk.RadioMenuItem(None,"None")
-                default_item.connect("toggled", self.__on_show_generalized)
-                self.__gen_list.append(default_item)
-                for t in sorted(self.__active_osm_object.generalized):
-                    list_item = gtk.RadioMenuItem(default_item,'%s'%t)
-                    list_item.connect("toggled", self.__on_show_generalized, t)
-                    self.__gen_list.append(list_item)
-                    if t == tolerance:
-                        list_item.set_active(True)
-                self.__generalized.set_submenu(self.__gen_list)
-                self.__generalized.set_sensitive(True)
-                self.__apply_generalization.set_sensitive(True)
-                
-                self.__select_poi.set_sensitive(False)
-                self.__connect_poi.set_sensitive(False)
-                self.__connect_partitions.set_sensitive(False)
-                self.__filter_streets.set_sensitive(False)
-                self.__apply_filter.set_sensitive(False)
-                self.__remove_filter.set_sensitive(False)
-                self.__remove_nodes.set_sensitive(False)
+                if self.__gen_list is None:
+                    self.__gen_list = gtk.Menu()
+                    self.__gen_default = gtk.RadioMenuItem(None,"None")
+                    self.__gen_default.connect("toggled", self.__on_show_generalized)
+                    self.__gen_list.append(self.__gen_default)
+                    self.__generalized.set_submenu(self.__gen_list)
+                # the items of earlier generalizations are kept, only new tolerances are added
+                for position, t in enumerate(self.__active_osm_object.generalized, 1):
+                    if t not in self.__gen_items:
+                        list_item = gtk.RadioMenuItem(self.__gen_default,'%s'%t)
+                        list_item.connect("toggled", self.__on_show_generalized, t)
+                        self.__gen_list.insert(list_item, position)
+                        self.__gen_items[t] = list_item
+                if tolerance in self.__gen_items:
+                    self.__gen_items[tolerance].set_active(True)
+                self.__set_menu_state('generalized')
                 
-                self.__main_window.show_all()
+                # only the submenu has to be shown, the window layout doesn't change
+                self.__gen_list.show_all()
 
     def __on_apply_generalization(self, widget=None):
         if self.__active_osm_object:
@@ -506,28 +499,55 @@ class MainWindow(object):
             #TODO: remove debug code
             #for node in self.__active_osm_object.node_objects:
             #    print len(node.neighbours)
-            ways = [self.__active_osm_object.getWayByID(index) for index in self.__active_osm_object.street_tree.intersection(self.__active_osm_object.box, "raw")]
-            for way in ways:
+            osm = self.__active_osm_object
+            ways = osm.getWaysByIDs(osm.street_tree.intersection(osm.box, "raw"))
+            
+            # generalize the ways in batches between which the GUI is updated,
+            # the menu items are deactivated until all ways are done
+            self.__applying = True
+            self.__set_menu_state('loading')
+            gobject.idle_add(self.__apply_generalization_step, self.__apply_generalization_batches(ways, tolerance))
+
+    def __apply_generalization_batches(self, ways, tolerance):
+        """ Applies a generalization to the ways, yields after every L{APPLY_BATCH_SIZE} ways
+        
+        @param ways: the ways to generalize
+        @param tolerance: tolerance value of the generalization
+        """
+        for start in xrange(0, len(ways), APPLY_BATCH_SIZE):
+            for way in ways[start:start + APPLY_BATCH_SIZE]:
                 way.apply_generalization(tolerance)
-            self.__active_osm_object.reset_generalized()
-            self.__generalized.set_sensitive(False)
-            self.__apply_generalization.set_sensitive(False)
-            self.__map.show_generalized = 0
-            self.__active_osm_object.get_partitions().recalculate = True
+            yield True
 
-            self.__changed = True
-            
-            self.__select_poi.set_sensitive(True)
-            self.__connect_poi.set_sensitive(False)
-            self.__connect_partitions.set_sensitive(True)
-            self.__filter_streets.set_sensitive(True)
-            self.__apply_filter.set_sensitive(False)
-            self.__remove_filter.set_sensitive(False)
-            self.__remove_nodes.set_sensitive(True)
-            
-            #TODO: remove debug code
-            #for node in self.__active_osm_object.node_objects:
-            #    print len(node.neighbours)
+    def __apply_generalization_step(self, batches):
+        """ Generalizes the next batch of ways, called in the GTK main loop
+        
+        After the last batch the map is updated.
+        
+        @param batches: generator returned by L{__apply_generalization_batches}
+        @returns: C{True} as long as there are ways left, so the idle callback is called again
+        @rtype: C{bool}
+        """
+        if next(batches, False):
+            return True
+        
+        self.__applying = False
+        self.__active_osm_object.reset_generalized()
+        self.__clear_generalized_menu()
+        self.__map.show_generalized = 0
+        self.__map.invalidate()
+        self.__area.queue_draw()
+        self.__active_osm_object.get_partitions().recalculate = True
+
+        self.__changed = True
+        
+        self.__set_menu_state('loaded')
+        self.__set_menu_state('generalization_applied')
+        
+        #TODO: remove debug code
+        #for node in self.__active_osm_object.node_objects:
+        #    print len(node.neighbours)
+        return False
 
     def __on_remove_nodes(self, widget=None):
         self.__active_osm_object.remove_unused_nodes()
@@ -582,59 +602,114 @@ class MainWindow(object):
         save_message.destroy()   
 
     def __on_key_press_event(self, widget, event):
-        keyname = gtk.gdk.keyval_name(event.keyval)
         # TODO: remove debug message
-        #print "Key %s (%d) was pressed" % (keyname, event.keyval)
+        #print "Key %s (%d) was pressed" % (gtk.gdk.keyval_name(event.keyval), event.keyval)
+        # the map must not be moved or redrawn while it is loaded or generalized
+        if self.__loading or self.__applying:
+            return
+        action = self.__key_actions.get(event.keyval)
+        if action:
+            action()
         if self.__map:
-            
-            # '+' and '-' are already covered by the accelerator keys
-            if keyname == 'i':                
-                self.__map.zoom_in()
-                self.__apply_map_change()
-
-            if keyname == 'o' and self.__last_key != 'Control_L' and self.__last_key != 'Control_R':
-                self.__map.zoom_out()
-                self.__apply_map_change()
-                
-            elif keyname in ['Left', 'Right', 'Up', 'Down']:
-                self.__map.move(keyname)
-                self.__apply_map_change()
+            self.__last_key = event.keyval
 
-            self.__last_key = keyname
+    def __key_zoom_out(self):
+        # Ctrl+O opens a file
+        if self.__last_key != gtk.keysyms.Control_L and self.__last_key != gtk.keysyms.Control_R:
+            self.__on_zoom_out()
 
-        if keyname == 'T':
-            self.__show_tiles.set_active(not self.__show_tiles.get_active())
-            self.__toggle_tiles()
-
-        if keyname == 'P':
-            self.__show_partitions.set_active(not self.__show_partitions.get_active())
-            self.__toggle_partitions()
-                
+    def __key_move(self, keyname):
+        if self.__map:
+            from geo.osm_map_rendering import MOVE_STEPS
+            # collect the key presses and move the map once per frame
+            step_x, step_y = MOVE_STEPS[keyname]
+            self.__pending_pan[0] += step_x
+            self.__pending_pan[1] += step_y
+            if not self.__pan_scheduled:
+                self.__pan_scheduled = True
+                gobject.timeout_add(PAN_DELAY, self.__flush_pan)
+
+    def __key_toggle(self, item):
+        # the toggled signal of the item updates the map
+        item.set_active(not item.get_active())
+
+    def __flush_pan(self):
+        """ Moves the map by the arrow key presses collected since the last move
+        
+        @returns: False, the method is called only once by the GTK main loop
+        """
+        self.__pan_scheduled = False
+        steps_x, steps_y = self.__pending_pan
+        self.__pending_pan = [0, 0]
+        if self.__map and (steps_x or steps_y):
+            self.__map.move_by(steps_x, steps_y)
+            self.__apply_map_change()
+        return False
+
+    def __reset_map_settings(self):
+        """ Resets the display settings of the view menu when a map is opened or closed
+        """
+        self.__show_tiles.set_active(False)
+        self.__show_partitions.set_active(False)
+        self.__clear_generalized_menu()
+
+    def __clear_generalized_menu(self):
+        """ Discards the submenu of the generalizations, it is built again by the next generalization
+        """
+        self.__gen_list = None
+        self.__gen_items = {}
+        self.__generalized.remove_submenu()
+
+    def __set_menu_state(self, state):
+        """ Sets the sensitivity of the menu items for a state of the MoSP GeoTool
+        
+        Only the items whose sensitivity changes are updated.
+        
+        @type state: C{str}
+        @param state: name of the state, a key of L{MENU_STATES}
+        """
+        for name, sensitive in MENU_STATES[state].iteritems():
+            item = self.__menu_items[name]
+            if item.get_property('sensitive') != sensitive:
+                item.set_sensitive(sensitive)
 
     def __apply_map_change(self):
-        if self.__map_container:
-            self.__vbox.remove(self.__map_container)
-        self.__map_container = self.__map.getArea()
-        self.__vbox.pack_start(self.__map_container)
-        self.__main_window.show_all()
+        # the window only needs a new layout pass if the map widget was replaced,
+        # otherwise redrawing the map is enough
+        if self.__area is not self.__map_container:
+            if self.__map_container:
+                self.__vbox.remove(self.__map_container)
+            self.__map_container = self.__area
+            self.__vbox.pack_start(self.__map_container)
+            self.__main_window.show_all()
+        else:
+            self.__map_container.queue_draw()
         self.__map_container.set_vadjustment(self.__map.vadj)
         self.__map_container.set_hadjustment(self.__map.hadj)
 
     def __toggle_tiles(self):
         if self.__map:
-            self.__map.show_tiles = self.__show_tiles.get_active()
-            self.__map.getArea().queue_draw()
+            show_tiles = self.__show_tiles.get_active()
+            # nothing to redraw if the state didn't change
+            if show_tiles == self.__map.show_tiles:
+                return
+            self.__map.show_tiles = show_tiles
+            self.__area.queue_draw()
 
     def __toggle_partitions(self):
         if self.__map:
             show_partitions = self.__show_partitions.get_active()
+            if show_partitions == self.__map.show_partitions:
+                return
             self.__map.show_partitions = show_partitions
-            self.__map.getArea().queue_draw()
+            self.__area.queue_draw()
 
     def __toggle_generalized(self, tolerance):
         if self.__map:
+            if tolerance == self.__map.show_generalized:
+                return
             self.__map.show_generalized = tolerance
-            self.__apply_map_change()
+            self.__area.queue_draw()
             if tolerance == 0:
                 self.__apply_generalization.set_sensitive(False)
             else:
@@ -642,9 +717,11 @@ class MainWindow(object):
             
 
 def main():
+    # the OSM import runs in a background thread
+    gobject.threads_init()
+    MainWindow()
     gtk.main()
     return 0
 
 if __name__ == "__main__":
-    MainWindow()
     main()
@@ -63,11 +63,17 @@ class PartitionConnectionWindow(object):
         response = partition_connect_window.run()
         
         if response == gtk.RESPONSE_ACCEPT:
-            self.__thresholds.setdefault('search',distance_field.get_text())
-            self.__thresholds.setdefault('projection',projection_field.get_text())
-            self.__thresholds.setdefault('size',size_field.get_text())
-            self.__thresholds.setdefault('connection',connection_field.get_text())
-            self.__thresholds.setdefault('distance',connection_distance_field.get_text())
+            # the thresholds are converted to integers once here, not by every partition connection
+            # input that is no integer is ignored instead of raising a ValueError
+            fields = {'search': distance_field,
+                      'projection': projection_field,
+                      'size': size_field,
+                      'connection': connection_field,
+                      'distance': connection_distance_field}
+            texts = dict((key, field.get_text().strip()) for key, field in fields.iteritems())
+            if all(text.isdigit() for text in texts.itervalues()):
+                for key, text in texts.iteritems():
+                    self.__thresholds.setdefault(key, int(text))
    
         partition_connect_window.destroy()
         
@@ -88,9 +88,15 @@ class PoiConnectionWindow(object):
         response = poi_connect_window.run()
         
         if response == gtk.RESPONSE_ACCEPT:
-            self.__thresholds.setdefault('search',distance_field.get_text())
-            self.__thresholds.setdefault('projection',projection_field.get_text())
-            self.__thresholds.setdefault('address',address_field.get_text())
+            # the thresholds are converted to integers once here
+            # input that is no integer is ignored instead of raising a ValueError
+            fields = {'search': distance_field,
+                      'projection': projection_field,
+                      'address': address_field}
+            texts = dict((key, field.get_text().strip()) for key, field in fields.iteritems())
+            if all(text.isdigit() for text in texts.itervalues()):
+                for key, text in texts.iteritems():
+                    self.__thresholds.setdefault(key, int(text))
         
         poi_connect_window.destroy()
         
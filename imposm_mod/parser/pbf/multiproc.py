@@ -40,13 +40,23 @@ class PBFMultiProcParser(object):
     ways_tag_filter = None
     relations_tag_filter = None
     
+    # modified for MoSP-GeoTool
+    #def __init__(self, pool_size, nodes_queue=None, ways_queue=None,
+    #    relations_queue=None, coords_queue=None, marshal_elem_data=False):
+    
+    # the original library does not support the import of the bounding box
+    # queue for bounding box added in the parameter list
     def __init__(self, pool_size, nodes_queue=None, ways_queue=None,
-        relations_queue=None, coords_queue=None, marshal_elem_data=False):
+        relations_queue=None, coords_queue=None, bounds_queue=None, marshal_elem_data=False):
+    # end of modification
         self.pool_size = pool_size
         self.nodes_callback = nodes_queue.put if nodes_queue else None
         self.ways_callback = ways_queue.put if ways_queue else None
         self.relations_callback = relations_queue.put if relations_queue else None
         self.coords_callback = coords_queue.put if coords_queue else None
+        # modified for MoSP-GeoTool
+        self.bounds_callback = bounds_queue.put if bounds_queue else None
+        # end of modification
         self.marshal = marshal_elem_data
     def parse(self, filename):
         pos_queue = multiprocessing.JoinableQueue(32)
@@ -65,6 +75,14 @@ class PBFMultiProcParser(object):
         
         reader = PBFFile(filename)
         
+        # modified for MoSP-GeoTool
+        # the bounding box is stored in the file header
+        if self.bounds_callback:
+            bounds = reader.header.bounds()
+            if bounds:
+                self.bounds_callback(bounds)
+        # end of modification
+        
         for pos in reader.blob_offsets():
             pos_queue.put(pos)
         
@@ -18,6 +18,10 @@ import struct
 import sys
 import zlib
 
+# modified for MoSP-GeoTool
+from time import gmtime, strftime
+# end of modification
+
 from marshal import dumps
 
 from imposm_mod.parser.pbf import OSMPBF
@@ -29,6 +33,11 @@ _MEMBERTYPE = {0 : 'node',
                1 : 'way',
                2 : 'relation'}
 
+# modified for MoSP-GeoTool
+# the elements are delivered with their attributes like by the XML parser
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# end of modification
+
 
 
 class PBFParser(object):
@@ -46,13 +55,25 @@ class PBFParser(object):
     :param marshal:
         return the data as a marshaled string
     """
+    # modified for MoSP-GeoTool
+    #def __init__(self, nodes_callback=None, ways_callback=None,
+    #    relations_callback=None, coords_callback=None, nodes_tag_filter=None,
+    #    ways_tag_filter=None, relations_tag_filter=None, marshal=False):
+    
+    # the original library does not support the import of the bounding box
+    # callback function for for bounding box added in the parameter list
     def __init__(self, nodes_callback=None, ways_callback=None,
-        relations_callback=None, coords_callback=None, nodes_tag_filter=None,
+        relations_callback=None, coords_callback=None, bounds_callback=None, nodes_tag_filter=None,
         ways_tag_filter=None, relations_tag_filter=None, marshal=False):
+    # end of modification
         self.nodes_callback = nodes_callback
         self.ways_callback = ways_callback
         self.relations_callback = relations_callback
         self.coords_callback = coords_callback
+        # modified for MoSP-GeoTool
+        # the bounding box is read from the file header, see PBFFile.bounds
+        self.bounds_callback = bounds_callback
+        # end of modification
         self.nodes_tag_filter = nodes_tag_filter
         self.ways_tag_filter = ways_tag_filter
         self.relations_tag_filter = relations_tag_filter
@@ -84,11 +105,18 @@ class PBFParser(object):
             if nodes_callback:
                 if self.nodes_tag_filter:
                     self.nodes_tag_filter(node[1])
-                if node[1]:
-                    if self.marshal:
-                        nodes.append((node[0], dumps((node[1], node[2]), 2)))
-                    else:
-                        nodes.append((node[0], node[1], node[2]))
+                # modified for MoSP-GeoTool
+                # nodes without tags are delivered as well, with their attributes
+                #if node[1]:
+                #    if self.marshal:
+                #        nodes.append((node[0], dumps((node[1], node[2]), 2)))
+                #    else:
+                #        nodes.append((node[0], node[1], node[2]))
+                if self.marshal:
+                    nodes.append((node[0], dumps((node[1], node[2]), 2)))
+                else:
+                    nodes.append(node)
+                # end of modification
                 if len(nodes) >= 256:
                     nodes_callback(nodes)
                     nodes = []
@@ -111,7 +139,10 @@ class PBFParser(object):
             if self.marshal:
                 ways.append((way[0], dumps((way[1], way[2]), 2)))
             else:
-                ways.append((way[0], way[1], way[2]))
+                # modified for MoSP-GeoTool
+                #ways.append((way[0], way[1], way[2]))
+                ways.append(way)    # attributes are also added
+                # end of modification
             if len(ways) >= 256:
                 self.ways_callback(ways)
                 ways = []
@@ -122,12 +153,18 @@ class PBFParser(object):
         for relation in reader.relations():
             if self.relations_tag_filter:
                 self.relations_tag_filter(relation[1])
-                if not relation[1]:
-                    continue
+                # modified for MoSP-GeoTool
+                # relations without tags are delivered as well
+                #if not relation[1]:
+                #    continue
+                # end of modification
             if self.marshal:
                 relations.append((relation[0], dumps((relation[1], relation[2]), 2)))
             else:
-                relations.append((relation[0], relation[1], relation[2]))
+                # modified for MoSP-GeoTool
+                #relations.append((relation[0], relation[1], relation[2]))
+                relations.append(relation)  # attributes are also added
+                # end of modification
             if len(relations) >= 256:
                 self.relations_callback(relations)
                 relations = []
@@ -158,6 +195,9 @@ class PrimitiveBlockParser(object):
         self.primitive_block.ParseFromString(data)
         self.primitivegroup = self.primitive_block.primitivegroup
         self.stringtable = decoded_stringtable(self.primitive_block.stringtable.s)
+        # modified for MoSP-GeoTool
+        self.date_granularity = self.primitive_block.date_granularity or 1000
+        # end of modification
     
     def __repr__(self):
         return '<PrimitiveBlockParser %r>' % (self.pos, )
@@ -183,11 +223,33 @@ class PrimitiveBlockParser(object):
                 keyflag = False
         return tags, pos
     
+    # modified for MoSP-GeoTool
+    # the elements are delivered with their attributes like by the XML parser
+    def _attributes(self, version, timestamp, changeset, uid, user_sid):
+        """
+        Return the attributes of an element as the XML parser delivers them.
+        """
+        return {'version': str(version),
+                'timestamp': strftime(TIMESTAMP_FORMAT, gmtime(timestamp * self.date_granularity // 1000)),
+                'changeset': str(changeset),
+                'uid': str(uid),
+                'user': self.stringtable[user_sid],
+                'visible': 'true'}
+    
+    def _info_attributes(self, info):
+        """
+        Return the attributes of an element with an ``Info`` message.
+        """
+        if info is None:
+            return {}
+        return self._attributes(info.version, info.timestamp, info.changeset, info.uid, info.user_sid)
+    # end of modification
+    
     def nodes(self):
         """
         Return an iterator for all *nodes* in this primitive block.
         
-        :rtype: iterator of ``(osm_id, tags, (lon, lat))`` tuples
+        :rtype: iterator of ``(osm_id, tags, (lon, lat), attributes)`` tuples
         """
         for group in self.primitivegroup:
             dense = group.dense
@@ -202,26 +264,57 @@ class PrimitiveBlockParser(object):
                 lons = dense.lon
                 keys_vals = dense.keys_vals
                 last_id = last_lat = last_lon = last_keysvals_pos = 0
+                # modified for MoSP-GeoTool
+                # the attributes of dense nodes are delta coded like their ids
+                denseinfo = dense.denseinfo
+                if denseinfo is not None:
+                    versions = denseinfo.version
+                    timestamps = denseinfo.timestamp
+                    changesets = denseinfo.changeset
+                    uids = denseinfo.uid
+                    user_sids = denseinfo.user_sid
+                    last_timestamp = last_changeset = last_uid = last_user_sid = 0
+                # end of modification
                 for i in xrange(len(ids)):
                     last_id += ids[i]
                     last_lat += coord_scale * (lat_offset + (granularity * lats[i]))
                     last_lon += coord_scale * (lon_offset + (granularity * lons[i]))
                     tags, last_keysvals_pos = get_tags(keys_vals, last_keysvals_pos)
-                    yield (last_id, tags, (last_lon, last_lat))
+                    # modified for MoSP-GeoTool
+                    #yield (last_id, tags, (last_lon, last_lat))
+                    if denseinfo is not None:
+                        last_timestamp += timestamps[i]
+                        last_changeset += changesets[i]
+                        last_uid += uids[i]
+                        last_user_sid += user_sids[i]
+                        attributes = self._attributes(versions[i], last_timestamp, last_changeset, last_uid, last_user_sid)
+                    else:
+                        attributes = {}     # every node gets its own dictionary
+                    yield (last_id, tags, (last_lon, last_lat), attributes)
+                    # end of modification
             nodes = group.nodes
             if nodes:
                 for node in nodes:
                     keys, vals = node.keys, node.vals
-                    tags = []
+                    # modified for MoSP-GeoTool
+                    # the tags are a dictionary like for the other elements
+                    #tags = []
+                    #for i in xrange(len(keys)):
+                    #    tags.append((self.stringtable[keys[i]], self.stringtable[vals[i]]))
+                    #yield (node.id, tags, (node.lon, node.lat))
+                    tags = {}
                     for i in xrange(len(keys)):
-                        tags.append((self.stringtable[keys[i]], self.stringtable[vals[i]]))
-                    yield (node.id, tags, (node.lon, node.lat))
+                        tags[self.stringtable[keys[i]]] = self.stringtable[vals[i]]
+                    lon = 0.000000001 * ((self.primitive_block.lon_offset or 0) + (self.primitive_block.granularity * node.lon))
+                    lat = 0.000000001 * ((self.primitive_block.lat_offset or 0) + (self.primitive_block.granularity * node.lat))
+                    yield (node.id, tags, (lon, lat), self._info_attributes(node.info))
+                    # end of modification
     
     def ways(self):
         """
         Return an iterator for all *ways* in this primitive block.
         
-        :rtype: iterator of ``(osm_id, tags, [ref1, ref2, ...])`` tuples
+        :rtype: iterator of ``(osm_id, tags, [ref1, ref2, ...], attributes)`` tuples
         """
         for group in self.primitivegroup:
             ways = group.ways
@@ -239,13 +332,16 @@ class PrimitiveBlockParser(object):
                     for delta in delta_refs:
                         ref += delta
                         refs.append(ref)
-                    yield (way.id, tags, refs)
+                    # modified for MoSP-GeoTool
+                    #yield (way.id, tags, refs)
+                    yield (way.id, tags, refs, self._info_attributes(way.info))
+                    # end of modification
     
     def relations(self):
         """
         Return an iterator for all *relations* in this primitive block.
         
-        :rtype: iterator of ``(osm_id, tags, [(ref1, type, role), ...])`` tuples
+        :rtype: iterator of ``(osm_id, tags, [(ref1, type, role), ...], attributes)`` tuples
         
         """
         for group in self.primitivegroup:
@@ -265,7 +361,10 @@ class PrimitiveBlockParser(object):
                     tags = {}
                     for i in xrange(len(keys)):
                         tags[self.stringtable[keys[i]]] = self.stringtable[vals[i]]
-                    yield (relation.id, tags, members)
+                    # modified for MoSP-GeoTool
+                    #yield (relation.id, tags, members)
+                    yield (relation.id, tags, members, self._info_attributes(relation.info))
+                    # end of modification
                     
 class PBFHeader(object):
     def __init__(self, filename, blob_pos, blob_size):
@@ -275,6 +374,21 @@ class PBFHeader(object):
         
     def required_features(self):
         return set(self.header_block.required_features)
+    
+    # modified for MoSP-GeoTool
+    # the original library does not support the import of the bounding box
+    def bounds(self):
+        """
+        Return the bounding box of the file as ``[minlon, minlat, maxlon, maxlat]``
+        or ``None`` if the header has no bounding box.
+        """
+        bbox = self.header_block.bbox
+        if bbox is None:
+            return None
+        coord_scale = 0.000000001
+        return [bbox.left * coord_scale, bbox.bottom * coord_scale,
+                bbox.right * coord_scale, bbox.top * coord_scale]
+    # end of modification
 
 
 def read_blob_zlib_data(filename, blob_pos, blob_size):
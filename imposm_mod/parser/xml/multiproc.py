@@ -21,7 +21,7 @@ from Queue import Empty
 # modified for MoSP-GeoTool
 #from imposm.parser.xml.parser import XMLParser
 #from imposm.parser.util import setproctitle
-from imposm_mod.parser.xml.parser import XMLParser
+from imposm_mod.parser.xml.parser import XMLParser, BATCH_SIZE
 from imposm_mod.parser.util import setproctitle
 # end of modification
 
@@ -88,8 +88,11 @@ class XMLMultiProcParser(object):
     
     # the original library does not support the import of the bounding box
     # queue for bounding box added in the parameter list
+    # the size of the batches put into the queues can be set by batch_size
+    # nodes without tags are only skipped if skip_empty_nodes is set
     def __init__(self, pool_size, nodes_queue=None, ways_queue=None,
-        relations_queue=None, coords_queue=None, bounds_queue=None, marshal_elem_data=False):
+        relations_queue=None, coords_queue=None, bounds_queue=None, marshal_elem_data=False,
+        batch_size=BATCH_SIZE, skip_empty_nodes=False):
     # end of modification
         self.pool_size = pool_size
         self.pool = []
@@ -104,6 +107,10 @@ class XMLMultiProcParser(object):
         self.mmap_pool = MMapPool(pool_size*8, xml_chunk_size*8)
         self.mmap_queue = multiprocessing.JoinableQueue(8)
         self.marshal_elem_data = marshal_elem_data
+        # modified for MoSP-GeoTool
+        self.batch_size = batch_size
+        self.skip_empty_nodes = skip_empty_nodes
+        # end of modification
         
     def parse(self, stream):
         assert not self.pool
@@ -117,6 +124,8 @@ class XMLMultiProcParser(object):
                 ways_tag_filter=self.ways_tag_filter,
                 relations_tag_filter=self.relations_tag_filter,
                 marshal_elem_data=self.marshal_elem_data,
+                batch_size=self.batch_size,     # modified for MoSP-GeoTool
+                skip_empty_nodes=self.skip_empty_nodes,     # modified for MoSP-GeoTool
             )
             self.pool.append(proc)
             proc.start()
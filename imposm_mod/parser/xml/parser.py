@@ -21,6 +21,12 @@ from marshal import dumps
 from imposm_mod.parser.xml.util import log_file_on_exception, iterparse
 # end of modification
 
+# modified for MoSP-GeoTool
+#: default number of nodes, ways and relations passed to a callback at once,
+#: coordinates are passed in batches four times as large
+BATCH_SIZE = 128
+# end of modification
+
 class XMLParser(object):
     # modified for MoSP-GeoTool
     
@@ -30,9 +36,13 @@ class XMLParser(object):
     
     # the original library does not support the import of the bounding box
     # callback function for for bounding box added in the parameter list
+    # the size of the batches passed to the callbacks can be set by batch_size
+    # nodes without tags are only skipped like by the original library if skip_empty_nodes is set,
+    # the GeoTool needs all nodes because the ways refer to them
     def __init__(self, nodes_callback=None, ways_callback=None,
         relations_callback=None, coords_callback=None, bounds_callback=None, nodes_tag_filter=None,
-        ways_tag_filter=None, relations_tag_filter=None, marshal_elem_data=False):
+        ways_tag_filter=None, relations_tag_filter=None, marshal_elem_data=False,
+        batch_size=BATCH_SIZE, skip_empty_nodes=False):
     # end of modification
         self.nodes_callback = nodes_callback
         self.ways_callback = ways_callback
@@ -46,6 +56,10 @@ class XMLParser(object):
         self.ways_tag_filter = ways_tag_filter
         self.relations_tag_filter = relations_tag_filter
         self.marshal_elem_data = marshal_elem_data
+        # modified for MoSP-GeoTool
+        self.batch_size = batch_size
+        self.skip_empty_nodes = skip_empty_nodes
+        # end of modification
     
     def parse(self, xml):
         with log_file_on_exception(xml):
@@ -111,27 +125,49 @@ class XMLParser(object):
 #
 # modified code follows
             
+            # new code: the attributes are looked up once, not for every element
+            nodes_callback = self.nodes_callback
+            ways_callback = self.ways_callback
+            relations_callback = self.relations_callback
+            coords_callback = self.coords_callback
+            bounds_callback = self.bounds_callback
+            nodes_tag_filter = self.nodes_tag_filter
+            ways_tag_filter = self.ways_tag_filter
+            relations_tag_filter = self.relations_tag_filter
+            marshal_elem_data = self.marshal_elem_data
+            root_clear = root.clear
+            batch_size = self.batch_size
+            coords_batch_size = 4 * batch_size
+            skip_empty_nodes = self.skip_empty_nodes
+            
+            # new code: the iterparser only reports end events
             for event, elem in context:
-                if event == 'start': continue
+                # new code: the tag and the attributes are looked up only once per element
+                tag = elem.tag
+                attrib = elem.attrib
                 
-                # new code: bound/bounds added
-                if elem.tag == 'bounds':
-                    minlon, minlat = float(elem.attrib['minlon']), float(elem.attrib['minlat'])
-                    maxlon, maxlat = float(elem.attrib['maxlon']), float(elem.attrib['maxlat'])
-                    if self.bounds_callback:
-                        bounds.extend([minlon, minlat, maxlon, maxlat])
-                elif elem.tag == 'bound':
-                    box = elem.attrib['box'].split(',')
-                    box = [float(i) for i in box]
-                    minlat, minlon, maxlat, maxlon = box
-                    if self.bounds_callback:
-                        bounds.extend([minlon, minlat, maxlon, maxlat])
-
-                elif elem.tag == 'tag':
-                    tags[elem.attrib['k']] = elem.attrib['v']
-                elif elem.tag == 'node':
-                    osmid = int(elem.attrib['id'])
-                    x, y = float(elem.attrib['lon']), float(elem.attrib['lat'])
+                # new code: the branches are ordered by the frequency of the elements
+                if tag == 'nd':
+                    refs.append(int(attrib['ref']))
+                elif tag == 'tag':
+                    # new code: the few distinct keys and values recur very often,
+                    # interning them shares one string object per key/value in a batch
+                    # (non-ASCII values are unicode objects which cannot be interned)
+                    k, v = attrib['k'], attrib['v']
+                    if k.__class__ is str:
+                        k = intern(k)
+                    if v.__class__ is str:
+                        v = intern(v)
+                    tags[k] = v
+                elif tag == 'node' and skip_empty_nodes and not tags:
+                    # new code: nodes without tags are skipped before their attributes are converted
+                    pass
+                elif tag == 'node':
+                    # new code:
+                    # remove id, lon, lat from the attribute list while reading them
+                    # otherwise we will have them twice
+                    osmid = int(attrib.pop('id'))
+                    x, y = float(attrib.pop('lon')), float(attrib.pop('lat'))
 
 
 # the original library makes a difference
@@ -141,80 +177,78 @@ class XMLParser(object):
 #                    if self.coords_callback:
 #                        coords.append((osmid, x, y))
 
-                    # new code:
-                    # remove id, lon, lat from the attribute list
-                    # otherwise we will have them twice
-                    del elem.attrib['id']
-                    del elem.attrib['lon']
-                    del elem.attrib['lat']
-
-                    if self.nodes_tag_filter:
-                        self.nodes_tag_filter(tags)
+                    if nodes_tag_filter:
+                        nodes_tag_filter(tags)
 #                    if tags and self.nodes_callback:
-                    if self.nodes_callback:     # new code
-                        if self.marshal_elem_data:
+                    if nodes_callback and (tags or not skip_empty_nodes):     # new code
+                        if marshal_elem_data:
                             nodes.append((osmid, dumps((tags, (x, y)), 2)))
                         else:
 #                            nodes.append((osmid, tags, (x, y)))
-                            nodes.append((osmid, tags, (x, y), elem.attrib))    # new code: attributes are also added
+                            nodes.append((osmid, tags, (x, y), attrib))    # new code: attributes are also added
                     tags = {}
-                elif elem.tag == 'nd':
-                    refs.append(int(elem.attrib['ref']))
-                elif elem.tag == 'member':
-                    members.append((int(elem.attrib['ref']), elem.attrib['type'], elem.attrib['role']))
-                elif elem.tag == 'way':
-                    osm_id = int(elem.attrib['id'])
-                    del elem.attrib['id']   # new code: remove id from the attribute list
-                    if self.ways_tag_filter:
-                        self.ways_tag_filter(tags)
-                    if self.ways_callback:
-                        if self.marshal_elem_data:
+                elif tag == 'member':
+                    members.append((int(attrib['ref']), attrib['type'], attrib['role']))
+                elif tag == 'way':
+                    osm_id = int(attrib.pop('id'))   # new code: remove id from the attribute list
+                    if ways_tag_filter:
+                        ways_tag_filter(tags)
+                    if ways_callback:
+                        if marshal_elem_data:
                             ways.append((osm_id, dumps((tags, refs), 2)))
                         else:
 #                            ways.append((osm_id, tags, refs))
-                            ways.append((osm_id, tags, refs, elem.attrib))  # new code: attributes are also added
+                            ways.append((osm_id, tags, refs, attrib))  # new code: attributes are also added
                     refs = []
                     tags = {}
-                elif elem.tag == 'relation':
-                    osm_id = int(elem.attrib['id'])
-                    del elem.attrib['id']   # new code: remove id from the attribute list
-                    if self.relations_tag_filter:
-                        self.relations_tag_filter(tags)
+                elif tag == 'relation':
+                    osm_id = int(attrib.pop('id'))   # new code: remove id from the attribute list
+                    if relations_tag_filter:
+                        relations_tag_filter(tags)
 #                    if tags and self.relations_callback:
-                    if self.relations_callback:     # new code
-                        if self.marshal_elem_data:
+                    if relations_callback:     # new code
+                        if marshal_elem_data:
                             relations.append((osm_id, dumps((tags, members), 2)))
                         else:
 #                            relations.append((osm_id, tags, members))
-                            relations.append((osm_id, tags, members, elem.attrib))  # new code: attributes are also added
+                            relations.append((osm_id, tags, members, attrib))  # new code: attributes are also added
                     members = []
                     tags = {}
+                # new code: bound/bounds added
+                elif tag == 'bounds':
+                    minlon, minlat = float(attrib['minlon']), float(attrib['minlat'])
+                    maxlon, maxlat = float(attrib['maxlon']), float(attrib['maxlat'])
+                    if bounds_callback:
+                        bounds.extend([minlon, minlat, maxlon, maxlat])
+                        # the bounding box is passed on right away, there is at most one per file
+                        bounds_callback(bounds)
+                        bounds = []
+                elif tag == 'bound':
+                    minlat, minlon, maxlat, maxlon = map(float, attrib['box'].split(','))
+                    if bounds_callback:
+                        bounds.extend([minlon, minlat, maxlon, maxlat])
+                        bounds_callback(bounds)
+                        bounds = []
 #####################
 # end of modification
 #####################
 
 
 
-                # modified for MoSP-GeoTool
-                if len(bounds) >= 1:
-                    self.bounds_callback(bounds)
-                    bounds = []
-                # end of modification
-            
-                if len(coords) >= 512:
-                    self.coords_callback(coords)
+                if len(coords) >= coords_batch_size:
+                    coords_callback(coords)
                     coords = []
-                if len(nodes) >= 128:
-                    self.nodes_callback(nodes)
+                if len(nodes) >= batch_size:
+                    nodes_callback(nodes)
                     nodes = []
-                if len(relations) >= 128:
-                    self.relations_callback(relations)
+                if len(relations) >= batch_size:
+                    relations_callback(relations)
                     relations = []
-                if len(ways) >= 128:
-                    self.ways_callback(ways)
+                if len(ways) >= batch_size:
+                    ways_callback(ways)
                     ways = []
 
-                root.clear()
+                root_clear()
         
             if self.coords_callback:
                 self.coords_callback(coords)
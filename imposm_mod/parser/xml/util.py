@@ -21,9 +21,25 @@ def iterparse(fileobj):
     Return root object and iterparser for given ``fileobj``. 
     """
     context = ET.iterparse(fileobj, events=("start", "end"))
-    context = iter(context)
+    # modified for MoSP-GeoTool
+    #context = iter(context)
+    #_event, root = context.next()
+    #return root, context
+    
+    # the start event of the root element is needed to get the root object,
+    # afterwards only end events are reported, so the parser does not have to skip
+    # every second event
     _event, root = context.next()
-    return root, context
+    parser = getattr(context, '_parser', None)
+    if parser is not None and hasattr(parser, '_setevents'):
+        # the events of the first data chunk are already buffered
+        events, index = context._events, context._index
+        events[index:] = [item for item in events[index:] if item[0] == "end"]
+        parser._setevents(events, ("end",))
+        return root, iter(context)
+    # fallback if the iterparse implementation is not the one of cElementTree
+    return root, ((event, elem) for event, elem in context if event == "end")
+    # end of modification
 
 @contextmanager
 def log_file_on_exception(xml):